@@ -0,0 +1,166 @@
+##########
+# File:     benchmark.py
+#
+# Times the chore optimizer on made-up houses of different sizes, so that
+# changes to chores.py can be compared for speed and results.
+# Run "python benchmark.py --help" for the options.
+#
+##########
+
+
+# Imports
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import subprocess
+import time
+import chores
+
+
+def synthetic_house(seed,nresidents,nchores,never_done=0.1):
+    """Makes up a house with random preferences.
+
+    Args:
+        seed: the random seed, so the same house can be made again
+        nresidents: how many people live there
+        nchores: how many chores there are, not counting Wild, which fills in
+            if there are more people than chores
+        never_done: the fraction of person/chore pairs that have never been
+            done (and so have zero misery), eg 0.02 for sparse or 0.5 for dense
+
+    Returns:
+        names: a list of strings, the initials of each person
+        week_chores: a list of strings, this week's chores, including Wild
+            fillers, shuffled into a starting assignment
+        prefs: a Preferences matrix, with never-done chores zeroed
+    """
+    rng=random.Random(seed)
+    names=["P{}".format(i) for i in range(nresidents)]
+    all_chores=["C{}".format(j) for j in range(nchores)]
+
+    # Random miseries from 1 to the number of rows, as on the spreadsheet
+    rows=all_chores+['Wild']
+    prefs=chores.Preferences(names,rows,
+            [[rng.randint(1,len(rows)) for c in rows] for n in names])
+    prefs.apply_knowns({n:[c for c in all_chores if rng.random()<never_done]
+        for n in names})
+
+    # More chores than people means some are skipped, fewer means Wild
+    week_chores=all_chores[:nresidents]\
+            +['Wild']*max(nresidents-nchores,0)
+    rng.shuffle(week_chores)
+    return names,week_chores,prefs
+
+def time_improve(names,week_chores,prefs,**kwargs):
+    """Runs improve() quietly and times it.
+
+    Args:
+        names, week_chores, prefs: as returned by synthetic_house
+        **kwargs: passed on to improve()
+
+    Returns:
+        a dict of the "seconds" it took, and the "misery_before" and
+        "misery_after"
+    """
+    start=time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        improved=chores.improve(names,week_chores,prefs,**kwargs)
+    seconds=time.perf_counter()-start
+    return {"seconds":seconds,
+            "misery_before":chores.misery(names,week_chores,prefs),
+            "misery_after":chores.misery(names,improved,prefs)}
+
+def run_benchmarks(sizes,seeds=3,extra_chores=(-2,0,2),
+        never_done=(0.02,0.5),engines=("dfs",),naskers=3):
+    """Times both optimizer paths on a grid of synthetic houses.
+
+    For each house, the full-cycle path (improve with largeloop=True, as at
+    the start of a cycle) and the pairwise path (improve with a few
+    restricted_askers and largeloop=False, as in the other weeks) are timed
+    separately.
+
+    Args:
+        sizes: the numbers of residents to try
+        seeds: how many random houses of each kind
+        extra_chores: how many more chores than residents to try, where
+            negative means there are Wild fillers
+        never_done: the never-done fractions to try, see synthetic_house
+        engines: the improve() engines to time
+        naskers: how many people are displaced and ask for pairwise swaps
+
+    Returns:
+        a list of dicts, one per run, describing the house and the path, and
+        the results from time_improve
+    """
+    results=[]
+    for nresidents in sizes:
+        for extra in extra_chores:
+            for nd in never_done:
+                for seed in range(seeds):
+                    names,week_chores,prefs=synthetic_house(seed,nresidents,
+                            max(nresidents+extra,1),nd)
+                    askers=random.Random(seed).sample(names,
+                            min(naskers,nresidents))
+                    house={"residents":nresidents,
+                            "chores":max(nresidents+extra,1),
+                            "wild":week_chores.count('Wild'),
+                            "never_done":nd,"seed":seed}
+
+                    # Time each path with each engine
+                    for engine in engines:
+                        for path,kwargs in [
+                                ("full",{}),
+                                ("pairwise",{"restricted_askers":askers,
+                                    "largeloop":False})]:
+                            result=dict(house,path=path,engine=engine)
+                            result.update(time_improve(names,week_chores,
+                                prefs,engine=engine,**kwargs))
+                            results+=[result]
+                            print("{residents:4d} people {chores:4d} chores"
+                                    " {never_done:5.2f} never-done seed"
+                                    " {seed:<3d} {path:9s} {engine:6s}"
+                                    " {seconds:9.4f}s misery"
+                                    " {misery_before:.3f} -> {misery_after:.3f}"
+                                    .format(**result),flush=True)
+    return results
+
+def save_results(results,path):
+    """Saves benchmark results as JSON, noting the commit they were run on.
+
+    Args:
+        results: as returned by run_benchmarks
+        path: the file to write
+    """
+    try:
+        commit=subprocess.run(["git","rev-parse","HEAD"],capture_output=True,
+                text=True,check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        commit=None
+    with open(path,'w') as f:
+        json.dump({"commit":commit,"date":str(datetime.datetime.now()),
+            "results":results},f,indent=1)
+
+# Go
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(
+            description="Times the chore optimizer on synthetic houses.")
+    parser.add_argument("--sizes",type=int,nargs="+",default=[4,6,8,10],
+            help="numbers of residents to try")
+    parser.add_argument("--seeds",type=int,default=3,
+            help="random houses of each kind")
+    parser.add_argument("--extra-chores",type=int,nargs="+",default=[-2,0,2],
+            help="chores minus residents to try (negative adds Wild)")
+    parser.add_argument("--never-done",type=float,nargs="+",
+            default=[0.02,0.5],help="never-done fractions to try")
+    parser.add_argument("--engines",nargs="+",default=["dfs"],
+            choices=sorted(chores.engines),help="improve() engines to time")
+    parser.add_argument("--out",default="benchmark.json",
+            help="where to save the results")
+    args=parser.parse_args()
+    save_results(run_benchmarks(args.sizes,args.seeds,args.extra_chores,
+        args.never_done,args.engines),args.out)
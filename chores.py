@@ -11,14 +11,27 @@
 
 
 # Imports
-import matplotlib.pyplot as plt
-import requests as rs
+# (matplotlib, requests and asyncio are slow to import, so they're only
+# imported when first needed, see _figure, _session and fetch_all)
 import datetime
 import numpy as np
 from collections import deque
 import random
 import os
+from collections.abc import Mapping
+import contextlib
+import io
+import argparse
+import json
+import time
+import traceback
+import concurrent.futures
+import hashlib
+import subprocess
+import sys
 import shutil
+import string
+import types
 
 # The misery spreadsheet is here
 # https://docs.google.com/spreadsheets/d/
@@ -34,35 +47,544 @@ tsv_url="https://docs.google.com/spreadsheets/d/"\
         "1hAq34ijA1pvcZZyv1So8rTvm2rzOfrDHion8INifApg/export?"\
         "format=tsv&id=1hAq34ijA1pvcZZyv1So8rTvm2rzOfrDHion8INifApg&gid=0"
 
+# What the current run has spent its time on, see start_trace.  None when
+# not tracing, so the instrumentation costs next to nothing
+_trace=None
 
-def get_preferences():
+def start_trace():
+    """Starts recording where a run spends its time.
+
+    While tracing, each phase (see phase) records its wall time, each loop
+    search records its counters under its asker (see _search_stats), and each
+    call to improve records its passes and trades.
+
+    Returns:
+        the trace dict, which fills in as the run goes
+    """
+    global _trace
+    _trace={"started":str(datetime.datetime.now()),"clock":time.perf_counter(),
+            "phases":[],"searches":{},"improve":[]}
+    return _trace
+
+def stop_trace(path=None):
+    """Stops tracing, and saves the trace as JSON.
+
+    Args:
+        path: where to save it, or None to not save it
+
+    Returns:
+        the finished trace dict
+    """
+    global _trace
+    trace,_trace=_trace,None
+    assert trace is not None, "Not tracing"
+    del trace["clock"]
+    if path:
+        _atomic_write(path,json.dumps(trace,indent=1))
+    return trace
+
+@contextlib.contextmanager
+def phase(name):
+    """Records the wall time of a phase of the run, if tracing.
+
+    Phases may overlap, eg the chart is drawn during the save, so each records
+    when it started (in seconds since start_trace) as well as how long it took.
+
+    Args:
+        name: what to call the phase in the trace
+    """
+    trace=_trace
+    if trace is None:
+        yield
+        return
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        trace["phases"]+=[{"phase":name,
+            "start":round(start-trace["clock"],6),
+            "seconds":round(time.perf_counter()-start,6)}]
+
+def _search_stats(asker):
+    """The loop search counters for one asker in the trace.
+
+    Args:
+        asker: the name of the person starting the searches
+
+    Returns:
+        a dict of counters, to be passed as stats to the loop search engines:
+            searches, how many times the asker searched
+            calls, how many times the search function was entered (for
+                _seek_loop, each recursion)
+            branches, how many switches were tried from someone
+            max_depth, the most people on a branch at once
+            loops, how many complete loops were found along the way
+            pruned, how many branches _seek_loop_bnb didn't need to try
+    """
+    return _trace["searches"].setdefault(asker,{"searches":0,"calls":0,
+        "branches":0,"max_depth":0,"loops":0,"pruned":0})
+
+
+class Preferences(Mapping):
+    """Everyone's misery levels, held as a dense persons x chores matrix.
+
+    The optimizer works on integer rows and columns of mat, but indexing by a
+    name still gives a mapping of that person's preferences, so the old
+    prefs[PERSONNAME][CHORENAME] access keeps working for reading.  The
+    mapping is a read-only copy, so writing to it raises a TypeError rather
+    than being silently lost: change mat directly, or use apply_knowns.
+
+    Attributes:
+        names: a list of strings, the initials of each person (rows of mat)
+        chores: a list of strings, the chore names including Wild (columns)
+        mat: a float array of misery levels, shape (len(names),len(chores))
+        name_index, chore_index: dicts mapping each name/chore to its
+            row/column in mat
+        sheet: the misery levels as on the spreadsheet, before apply_knowns
+            zeroed any, or None if it never has
+    """
+
+    def __init__(self,names,chores,mat):
+        self.names=list(names)
+        self.chores=list(chores)
+        self.mat=np.array(mat,dtype=float)
+        self.sheet=None
+        self.name_index={n:i for i,n in enumerate(self.names)}
+        self.chore_index={c:j for j,c in enumerate(self.chores)}
+        assert self.mat.shape==(len(self.names),len(self.chores))
+
+    @classmethod
+    def from_dict(cls,prefs):
+        """Builds the matrix from a prefs[PERSONNAME][CHORENAME] dict."""
+        names=list(prefs)
+        chores=list(dict.fromkeys(c for n in names for c in prefs[n]))
+        mat=[[prefs[n].get(c,np.nan) for c in chores] for n in names]
+        return cls(names,chores,mat)
+
+    def __getitem__(self,name):
+        return types.MappingProxyType(
+                dict(zip(self.chores,self.mat[self.name_index[name]].tolist())))
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def rows(self,names):
+        """Returns an array of the rows in mat for a list of names."""
+        return np.array([self.name_index[n] for n in names],dtype=int)
+
+    def cols(self,chores):
+        """Returns an array of the columns in mat for a list of chores."""
+        return np.array([self.chore_index[c] for c in chores],dtype=int)
+
+    def apply_knowns(self,knowns):
+        """Overwrites never-done chores (see read_knownpeople) with zero.
+
+        The misery levels from before are kept as sheet, see with_knowns.
+        """
+        pairs=[(self.name_index[n],self.chore_index[c])
+                for n,trychores in knowns.items() for c in trychores]
+        if len(pairs):
+            if self.sheet is None:
+                self.sheet=self.mat.copy()
+            self.mat[tuple(np.array(pairs).T)]=0
+
+    def with_knowns(self,knowns):
+        """Returns a copy with only these never-done chores zeroed.
+
+        Starts again from the spreadsheet's misery levels, so chores zeroed
+        before but not in knowns (eg done for the first time since) get their
+        misery back.
+        """
+        prefs=Preferences(self.names,self.chores,
+                self.sheet if self.sheet is not None else self.mat)
+        prefs.apply_knowns(knowns)
+        return prefs
+
+    def zeroed(self):
+        """Returns the never-done chores apply_knowns has zeroed, as a dict
+        like the knowns given to it."""
+        if self.sheet is None:
+            return {n:[] for n in self.names}
+        zeroed=(self.mat==0)&(self.sheet!=0)
+        return {n:[self.chores[j] for j in np.flatnonzero(zeroed[i])]
+                for i,n in enumerate(self.names)}
+
+    def as_dict(self):
+        """Returns the preferences as a plain dict-of-dicts."""
+        return {n:dict(self[n]) for n in self.names}
+
+
+def as_preferences(prefs):
+    """Returns prefs as a Preferences, converting from a dict if needed."""
+    if isinstance(prefs,Preferences):
+        return prefs
+    return Preferences.from_dict(prefs)
+
+
+class Assignment:
+    """Who has which of this week's chores, held as integer positions.
+
+    This week's chores are numbered as "slots", in the order first given, so
+    that repeated chores like Wild are told apart.  The assignment is then an
+    array of each person's slot and its inverse, so a loop of swaps only
+    touches the people in the loop, and the total misery is kept up to date
+    as they're made rather than summed up again.
+
+    Attributes:
+        names: a list of strings, the people
+        slot_chores: a list of strings, the chore in each slot
+        slot: an int array, the slot held by each person
+        holder: an int array, the person holding each slot
+        mat: a float array, where mat[i,s] is the misery names[i] would have
+            doing the chore in slot s
+        total: the sum of everyone's current misery
+        position: a dict mapping each name to its position in names
+
+    Args:
+        names, chores: the people and correspondingly ordered chores
+        prefs: as returned by get_preferences
+    """
+    __slots__=("names","slot_chores","slot","holder","mat","total","position")
+
+    def __init__(self,names,chores,prefs):
+        prefs=as_preferences(prefs)
+        self.names=list(names)
+        self.slot_chores=list(chores)
+        self.slot=np.arange(len(self.names))
+        self.holder=np.arange(len(self.names))
+        self.mat=prefs.mat[np.ix_(prefs.rows(self.names),
+            prefs.cols(self.slot_chores))]
+        self.total=float(np.trace(self.mat))
+        self.position={n:i for i,n in enumerate(self.names)}
+
+    @property
+    def chores(self):
+        """The chores as a list, ordered to correspond with names."""
+        return [self.slot_chores[s] for s in self.slot]
+
+    def chore(self,name):
+        """Returns the chore a person has."""
+        return self.slot_chores[self.slot[self.position[name]]]
+
+    def misery_matrix(self):
+        """Returns a fresh copy of W, see misery_matrix."""
+        return self.mat[:,self.slot]
+
+    def misery(self):
+        """The total misery of the assignment, see misery."""
+        return self.total/len(self.names)
+
+    def rotate(self,loop):
+        """Makes a loop of swaps, as found by seek_loop.
+
+        Args:
+            loop: positions of people, each of whom takes the chore of the
+                next, and the last the chore of the first
+        """
+        loop=np.asarray(loop,dtype=int)
+        new=self.slot[np.roll(loop,-1)]
+        self.total+=float(self.mat[loop,new].sum()
+                -self.mat[loop,self.slot[loop]].sum())
+        self.slot[loop]=new
+        self.holder[new]=loop
+
+    def permute(self,moves):
+        """Gives everyone the chore someone else has.
+
+        Args:
+            moves: an int array, where person i gets the chore that person
+                moves[i] has now
+        """
+        self.slot=self.slot[np.asarray(moves,dtype=int)]
+        self.holder[self.slot]=np.arange(len(self.names))
+        self.total=float(self.mat[np.arange(len(self.names)),self.slot].sum())
+
+    def copy(self):
+        """Returns an independent copy, sharing the misery levels."""
+        other=Assignment.__new__(Assignment)
+        for attr in Assignment.__slots__:
+            setattr(other,attr,getattr(self,attr))
+        other.slot=self.slot.copy()
+        other.holder=self.holder.copy()
+        return other
+
+
+# Shared by everything fetched, see _session
+_shared_session=None
+
+def _session(connections=16):
+    """Returns the requests.Session that all fetches share.
+
+    Sharing one session keeps connections open between fetches, and its
+    adapter retries failed connections and server errors with a backoff.
+
+    Args:
+        connections: the most fetches that will be going at once, so that
+            the session keeps that many connections open to each host
+            instead of dropping some (see fetch_all)
+    """
+    global _shared_session
+    import requests as rs
+    if _shared_session is None:
+        _shared_session=rs.Session()
+        _shared_session.connections=0
+    if _shared_session.connections<connections:
+        from urllib3.util.retry import Retry
+        retry=Retry(total=3,backoff_factor=0.5,
+                status_forcelist=(429,500,502,503,504))
+        adapter=rs.adapters.HTTPAdapter(max_retries=retry,
+                pool_maxsize=connections)
+        _shared_session.mount("http://",adapter)
+        _shared_session.mount("https://",adapter)
+        _shared_session.connections=connections
+    return _shared_session
+
+def fetch_tsv(url,cache_dir="preference_cache",ttl=0,timeout=10):
+    """Fetches a preference TSV, keeping a copy on disk.
+
+    The last copy fetched from each URL is kept in cache_dir along with its
+    ETag and Last-Modified headers.  If that copy is younger than ttl it is
+    used as is, otherwise the sheet is only downloaded again if it has
+    changed.  If the sheet can't be reached at all, the last copy is used.
+
+    Whatever is used is also saved as URLKEY_YYYY-MM-DD.tsv in cache_dir, so
+    the run can be replayed later by giving that file to get_preferences.
+
+    Args:
+        url: the TSV download link, eg tsv_url
+        cache_dir: the folder to keep copies in
+        ttl: how many seconds a copy is good for without asking the server
+        timeout: how many seconds to wait on the server
+
+    Returns:
+        the contents of the TSV, as bytes
+    """
+    os.makedirs(cache_dir,exist_ok=True)
+    key=hashlib.sha256(url.encode()).hexdigest()[:16]
+    body_path=os.path.join(cache_dir,key+".tsv")
+    meta_path=os.path.join(cache_dir,key+".json")
+
+    import requests as rs
+
+    # See what we have already
+    meta,body={},None
+    if os.path.exists(meta_path) and os.path.exists(body_path):
+        with open(meta_path,'r') as f:
+            meta=json.load(f)
+        with open(body_path,'rb') as f:
+            body=f.read()
+
+    # Ask the server, unless our copy is fresh enough
+    if body is None or time.time()-meta["fetched"]>=ttl:
+        headers={}
+        if "etag" in meta:
+            headers["If-None-Match"]=meta["etag"]
+        if "last_modified" in meta:
+            headers["If-Modified-Since"]=meta["last_modified"]
+        try:
+            res=_session().get(url,headers=headers,timeout=timeout)
+
+            # Keep our copy if it hasn't changed, or save the new one
+            if res.status_code==304 and body is not None:
+                print("Preferences haven't changed since",meta["date"])
+            else:
+                assert res.ok,\
+                        "Request failed, check the URL and sheet permissions"
+                body=res.content
+                _atomic_write(body_path,body)
+                meta={"url":url,"date":str(datetime.date.today())}
+                if "ETag" in res.headers:
+                    meta["etag"]=res.headers["ETag"]
+                if "Last-Modified" in res.headers:
+                    meta["last_modified"]=res.headers["Last-Modified"]
+            meta["fetched"]=time.time()
+            _atomic_write(meta_path,json.dumps(meta))
+
+        # If we can't get through, fall back on our copy if we have one
+        except rs.RequestException as e:
+            if body is None:
+                raise
+            print("Couldn't reach the sheet ("+type(e).__name__+"),"\
+                    " using the copy from",meta["date"])
+
+    # Save exactly what we used for this run
+    _atomic_write(os.path.join(cache_dir,
+        key+"_"+str(datetime.date.today())+".tsv"),body)
+    return body
+
+def sheet_tsv_url(sheet_id,gid=0):
+    """Returns the TSV download link for one tab of a spreadsheet.
+
+    Args:
+        sheet_id: the long id in the spreadsheet's link, after /d/
+        gid: the tab, as in the #gid= at the end of its link
+
+    Returns:
+        a URL like tsv_url, for fetch_tsv or fetch_all
+    """
+    return "https://docs.google.com/spreadsheets/d/"+sheet_id+"/export?"\
+            "format=tsv&id="+sheet_id+"&gid="+str(gid)
+
+def fetch_all(sources,concurrency=8,cache_dir="preference_cache",ttl=0,
+        timeout=10):
+    """Fetches and parses many preference TSVs at once.
+
+    Each source is fetched with fetch_tsv (so it's cached the same way) in a
+    worker thread, with up to concurrency of them going at once over the
+    shared session's pooled connections (see _session).  One source failing
+    doesn't stop the others.
+
+    Args:
+        sources: a list of URLs or local TSV files, eg from sheet_tsv_url
+        concurrency: the most fetches to have going at once
+        cache_dir, ttl, timeout: see fetch_tsv, where timeout is for each
+            request
+
+    Returns:
+        a dict mapping each source to what parse_preferences returned for
+        it, ie (all_names, all_chores, prefs), or to the exception raised
+        if it couldn't be fetched or parsed
+    """
+    import asyncio
+    sources=list(dict.fromkeys(sources))
+    if any(not os.path.exists(source) for source in sources):
+        _session(concurrency)
+    return asyncio.run(_fetch_all(sources,concurrency,cache_dir,ttl,timeout))
+
+async def _fetch_all(sources,concurrency,cache_dir,ttl,timeout):
+    """The event loop behind fetch_all, with the same arguments."""
+    import asyncio
+    asyncio.get_running_loop().set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=concurrency))
+    limit=asyncio.Semaphore(concurrency)
+
+    async def fetch(source):
+        async with limit:
+            return await asyncio.to_thread(_fetch_and_parse,source,
+                    cache_dir,ttl,timeout)
+
+    results=await asyncio.gather(*[fetch(source) for source in sources],
+            return_exceptions=True)
+    return dict(zip(sources,results))
+
+def _fetch_and_parse(source,cache_dir,ttl,timeout):
+    """Reads or fetches one TSV and parses it, for fetch_all."""
+    if os.path.exists(source):
+        with open(source,'rb') as f:
+            return parse_preferences(f)
+    return parse_preferences(fetch_tsv(source,cache_dir,ttl,timeout))
+
+def parse_preferences(stream):
+    """Parses the misery spreadsheet TSV in a single pass.
+
+    The first row is a header with everyone's initials, and each row after
+    that is a chore name followed by everyone's misery for it.  Rows with no
+    chore name are skipped.  The numbers are all converted and checked at
+    once at the end, and every one that isn't between 1 and the number of
+    rows is reported together.
+
+    Args:
+        stream: the TSV, as bytes or a binary file-like object
+
+    Returns:
+        all_names: a list of strings, the initials of each person
+        all_chores: a list of strings, the chore names, not including Wild
+        prefs: a Preferences matrix with a column for every row (including
+            Wild), before any never-done chores are zeroed
+    """
+    if isinstance(stream,bytes):
+        stream=io.BytesIO(stream)
+    lines=iter(stream)
+
+    # Header
+    all_names=next(lines).decode('utf-8').rstrip('\r\n').split('\t')[1:]
+    n=len(all_names)
+
+    # Gather the chore names and the text of every number
+    rows,all_chores,cells=[],[],[]
+    for line in lines:
+        chore,_,rest=line.decode('utf-8').rstrip('\r\n').partition('\t')
+        if chore=='':
+            continue
+        rows+=[chore]
+        if chore!='Wild':
+            all_chores+=[chore]
+        fields=rest.split('\t')[:n]
+        cells+=fields+['']*(n-len(fields))
+
+    # Convert them all together, marking any that aren't numbers
+    try:
+        mat=np.array(cells,dtype=float)
+    except ValueError:
+        mat=np.array([_float_or_nan(c) for c in cells])
+    mat=mat.reshape(len(rows),n).T
+
+    # Validate each input number is between 1 and number of chores
+    bad=~((mat>=1) & (mat<=len(rows)))
+    assert not np.any(bad),\
+            "Preferences must be between 1 and "+str(len(rows))+", but got "+\
+            ", ".join("{}/{}={!r}".format(all_names[i],rows[j],cells[j*n+i])
+                    for i,j in zip(*np.nonzero(bad)))
+
+    return all_names, all_chores, Preferences(all_names,rows,mat)
+
+def _float_or_nan(text):
+    """Converts text to a float, or NaN if it isn't a number."""
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+def get_preferences(knowns_from_history=False,source=None,
+        knownpeople_path="knownpeople.txt",history_path="history.txt",
+        cache_dir="preference_cache",ttl=0):
     """Returns the chore information from the misery spreadsheet.
 
     Uses tsv_url defined above to find the downloadable spreadsheet TSV.
 
+    Args:
+        knowns_from_history: if True, work out who has never done what from
+            history.txt (see update_history_store) instead of trusting
+            knownpeople.txt
+        source: the URL or local file of the TSV, if not tsv_url
+        knownpeople_path, history_path: where to find knownpeople.txt and
+            history.txt
+        cache_dir, ttl: see fetch_tsv
+
     Returns:
         all_names: a list of strings, the initials of each person
         all_chores: a list of strings, the chore names
-        prefs: a dict of preferences, accessed as prefs[PERSONNAME][CHORENAME] 
+        prefs: a Preferences matrix, which can still be accessed like a dict
+            as prefs[PERSONNAME][CHORENAME]
         knowns: as returned by read_knownpeople, but with new people added and
             former people removed
     """
 
-    # Try to connect and retreive the data
-    print("Fetching preferences",flush=True)
-    res=rs.get(url=tsv_url)
-    assert res.ok, "Request failed, check the URL and sheet permissions"
-
-    # Get the names and chores from the retreived object
+    # Try to connect and retreive the data, or read it from a file,
+    # and get the names, chores and preferences from it.
     # Don't include Wild as a chore, since that's filler for when there
     # are not enough chores
-    lines=[l.decode('utf-8') for l in res.iter_lines()]
-    data=[l.split('\t') for l in lines[1:] if l.split('\t')[0]!='']
-    all_names=lines[0].split('\t')[1:]
-    all_chores=[r[0] for r in data if r[0]!='Wild']
+    print("Fetching preferences",flush=True)
+    source=source if source else tsv_url
+    if os.path.exists(source):
+        with phase("parse"), open(source,'rb') as f:
+            all_names,all_chores,prefs=parse_preferences(f)
+    else:
+        with phase("fetch"):
+            data=fetch_tsv(source,cache_dir,ttl)
+        with phase("parse"):
+            all_names,all_chores,prefs=parse_preferences(data)
 
     # Read the current known people list
-    knowns=read_knownpeople(all_chores)
+    with phase("knowns"):
+        if knowns_from_history:
+            knowns=update_history_store(history_path)\
+                    .never_done(all_names,all_chores)
+        else:
+            knowns=read_knownpeople(all_chores,knownpeople_path)
 
     # Add in any new appearances
     for name in all_names:
@@ -78,21 +600,8 @@ def get_preferences():
                     "  [If you kill script now, this will not be done.]")
             del knowns[name]
 
-    # Form a dictionary of people's preferences
-    prefs={}
-    for i,n in enumerate(all_names):
-        prefs[n]={}
-        for r in data:
-            p=float(r[1+i])
-
-            # Validate each input number is between 1 and number of chores
-            assert p>=1 and p<=(len(data))
-            prefs[n][r[0]]=p
-
     # Overwrite never-done chores with zero misery
-    for person, trychores in knowns.items():
-        for chore in trychores:
-            prefs[person][chore]=0
+    prefs.apply_knowns(knowns)
 
     # Success, return it
     print("Got preferences\n")
@@ -151,8 +660,8 @@ def get_current_situation(all_names,all_chores):
     # If we have same number of chores as people, we good
     if lnames==lchores:
         print("That's perfect.")
-        print("Chores list is: "+", ".join(chores))
         chores=all_chores[:]
+        print("Chores list is: "+", ".join(chores))
 
     # If we have more people than chores, add wildcards
     elif lnames>lchores:
@@ -234,13 +743,63 @@ def get_current_situation(all_names,all_chores):
     return names, chores, force_names, force_chores
 
 
-def weekinfo():
+def choose_situation(all_names,all_chores,out_of_town=(),skip=(),force={}):
+    """Works out who is in town and what chores are needed, without asking.
+
+    The same as get_current_situation, but with the answers to its questions
+    given up front, eg for a batch run (see run_batch).
+
+    Args:
+        all_names, all_chores: as returned by get_preferences
+        out_of_town: a list of names of people out of town
+        skip: a list of chores to skip, needed only if there are more chores
+            than people in town
+        force: a dict of specific chore assignments, mapping names to chores
+
+    Returns:
+        names, chores, force_names, force_chores: see get_current_situation
+    """
+
+    # Take out the out-of-towners
+    for name in out_of_town:
+        assert name in all_names, "Who is "+name+"!?"
+    names=[name for name in all_names if name not in out_of_town]
+    lnames=len(names)
+    lchores=len(all_chores)
+
+    # Add in wildcards or skip chores to match the number of people
+    assert len(skip)==max(lchores-lnames,0),\
+            "Must skip exactly "+str(max(lchores-lnames,0))+" chores."
+    for chore in skip:
+        assert chore in all_chores, "What is "+chore+"!?"
+    chores=[chore for chore in all_chores if chore not in skip]\
+            +['Wild']*max(lnames-lchores,0)
+
+    # Move the specific assignments to separate lists
+    force_names,force_chores=[],[]
+    for force_name,force_chore in force.items():
+        assert force_name in names, "Invalid: "+force_name+"?"
+        assert force_chore in chores, "Invalid: "+force_chore+"?"
+        assert force_chore not in force_chores, "Doubled "+force_chore
+        force_names+=[force_name]
+        names.remove(force_name)
+        force_chores+=[force_chore]
+        chores.remove(force_chore)
+
+    # Success, return
+    return names, chores, force_names, force_chores
+
+
+def weekinfo(today=None):
     """Returns some useful info about the present week.
 
     The code assumes it's being run to assign chores "this weekend",
     where the date meant by "this weekend" switches over on every Monday.
     So this function just returns a bunch of attributes of this week.
 
+    Args:
+        today: the date object to treat as today, eg for simulate()
+
     Returns: 
         fourweekno: a counter that increases after every four Mondays
         weekno: a counter that increases after every Monday
@@ -250,7 +809,7 @@ def weekinfo():
     """
     # Arbirary Monday long ago
     epoch=datetime.date(2018,1,8)
-    today=datetime.date.today()#-datetime.timedelta(7)
+    today=today if today else datetime.date.today()#-datetime.timedelta(7)
 
     # Calculate the "fourweek number", ie the number of entire fourweeks that have elapsed
     fourweekno=int(np.floor(((today-epoch).days)/(4*7)))
@@ -266,7 +825,7 @@ def weekinfo():
 
     return fourweekno, weekno, mon, moncy
 
-def read_history():
+def read_history(path="history.txt"):
     """Reads the history file and returns its contents.
 
     The history is in 'history.txt' and contains what chore everyone did ever.
@@ -274,6 +833,16 @@ def read_history():
     followed by a sequence of INITIAL1:CHORE1,INITIALS2:CHORE2... indicating
     what each person did.
 
+    The file is only ever appended to (see add_to_history), so if a week
+    appears more than once, the last row for it is the one that counts.
+    Every row is saved ending in a newline, so a last row without one that
+    add_to_history was part-way through saving is left out (see
+    read_history_index).  A history made or edited any other way may not
+    end in a newline, and then its last row counts as usual.
+
+    Args:
+        path: the history file to read
+
     Returns:
         hist: a list of rows in the history file, each row is a list of
             (1) a date object for the relevant Monday, and (2) a dict
@@ -281,25 +850,420 @@ def read_history():
     """
 
     # If there's no history, don't complain, it's an empty list
-    if not os.path.exists("history.txt"):
+    if not os.path.exists(path):
         return []
 
     # Otherwise open up
-    with open("history.txt",'r') as f:
-        hist=[]
+    with open(path,'r') as f:
+        weeks={}
 
-        # Split each line
+        # Split each line, later rows for a week replacing earlier ones,
+        # unless it's the end of an interrupted save
         for line in f:
-            mon,assig=line.split(',',1)
-            
-            # Form a date object, assemble a dict, and add it to the list
-            mon=datetime.date(*[int(x) for x in mon.split('-')])
-            hist+=[[
-                mon,
-                dict([x.strip().split(':') for x in assig.split(',')])]]
-        return hist
-
-def read_knownpeople(all_chores):
+            if line.strip():
+                if not line.endswith('\n') and \
+                        _history_index(path)[1]<os.path.getsize(path):
+                    continue
+                mon,assig=_parse_history_line(line)
+                weeks[mon]=assig
+        return [[mon,assig] for mon,assig in weeks.items()]
+
+def _parse_history_line(line):
+    """Returns the Monday date object and assignment dict of a history row."""
+    mon,assig=line.split(',',1)
+    mon=datetime.date(*[int(x) for x in mon.split('-')])
+    return mon,dict([x.strip().split(':') for x in assig.split(',')])
+
+def read_history_index(path="history.txt"):
+    """Reads the index of where each week is in the history file.
+
+    The index lives next to the history (history.idx for history.txt), with
+    a row "YYYY-MM-DD OFFSET LENGTH" giving the bytes of every history row.
+    Rows appended to the history since the index was last written, or a
+    whole history file that has never been indexed, get indexed here.
+
+    The first row of the index notes the size and modification time of the
+    history when it was last indexed, and when the index was started.  If
+    the history has changed since in any way the index doesn't know about,
+    eg it was edited by hand, the index is built again from scratch.
+    While add_to_history is saving a row, the first row instead notes where
+    the save started, so if it's interrupted, the partial row it leaves is
+    known for what it is and not indexed.  A last row without a newline
+    found when building from scratch came from somewhere else, eg an older
+    history file, and is indexed as long as it makes sense.
+
+    Args:
+        path: the history file
+
+    Returns:
+        index: a dict mapping each Monday date object to the (offset, length)
+            of its latest row in the history file
+    """
+    return _history_index(path)[0]
+
+def _history_index(path):
+    """Does the work of read_history_index.
+
+    Returns:
+        index: as in read_history_index
+        end: the offset where the complete rows of the history file end
+        built: when the index was started, so anything compiled from the
+            history can tell if it was built again since
+    """
+    idxpath=os.path.splitext(path)[0]+".idx"
+    index,end,built={},0,None
+    if not os.path.exists(path):
+        return index,end,built
+
+    # Read the existing index, if it's still for the history as it is now,
+    # or a save was started at its end (noted with an mtime of 0)
+    stat=os.stat(path)
+    if os.path.exists(idxpath):
+        try:
+            with open(idxpath,'r') as f:
+                size,mtime,built=[int(x) for x in
+                        f.readline().lstrip('#').split()]
+                if mtime==0:
+                    if stat.st_size<size:
+                        raise ValueError("The history has changed")
+                elif (size,mtime)!=(stat.st_size,stat.st_mtime_ns):
+                    raise ValueError("The history has changed")
+                for l in f:
+                    mon,offset,length=l.split()
+                    offset,length=int(offset),int(length)
+                    index[datetime.date(*[int(x) for x in mon.split('-')])]=\
+                            offset,length
+                    end=max(end,offset+length)
+        except (ValueError,TypeError):
+            index,end,built={},0,None
+
+    # Otherwise start over
+    fresh=built is None
+    if fresh:
+        built=time.time_ns()
+        with open(idxpath,'w') as f:
+            f.write(_history_stamp(path,built))
+
+    # Index any complete rows past the end of the index
+    size=stat.st_size
+    if end<size:
+        new_rows=[]
+        with open(path,'rb') as f:
+            f.seek(end)
+            for line in f:
+                if line.strip():
+
+                    # A last row with no newline past a save started at the
+                    # end of the index was interrupted, even if what's there
+                    # happens to make sense.  Otherwise it's kept if it does
+                    if not line.endswith(b'\n'):
+                        if not fresh:
+                            break
+                        try:
+                            mon=_parse_history_line(line.decode())[0]
+                        except (ValueError,TypeError):
+                            break
+                    else:
+                        mon=_parse_history_line(line.decode())[0]
+                    index[mon]=end,len(line)
+                    new_rows+=[(mon,end,len(line))]
+                end+=len(line)
+        with open(idxpath,'a') as f:
+            for mon,offset,length in new_rows:
+                f.write("{} {} {}\n".format(mon,offset,length))
+        _restamp_history_index(path,built)
+
+    return index,end,built
+
+def _history_stamp(path,built):
+    """Returns the first row of the index for the history as it is now.
+
+    The numbers are padded to a fixed width, so the row can be updated in
+    place, see _restamp_history_index.
+    """
+    stat=os.stat(path)
+    return "# {:20d} {:20d} {:20d}\n".format(stat.st_size,stat.st_mtime_ns,
+            built)
+
+def _restamp_history_index(path,built,saving_from=None):
+    """Notes in the index that it's up to date with the history as it is now.
+
+    Args:
+        path: the history file
+        built: as returned by _history_index
+        saving_from: if supplied, notes instead that a save is starting at
+            this offset, see read_history_index
+    """
+    with open(os.path.splitext(path)[0]+".idx",'r+') as f:
+        if saving_from is None:
+            f.write(_history_stamp(path,built))
+        else:
+            f.write("# {:20d} {:20d} {:20d}\n".format(saving_from,0,built))
+
+def _read_row(mon,path="history.txt"):
+    """Reads one week's row straight out of the history file, using the index.
+
+    If the row found isn't that week's whole row, ending in a newline (or
+    the end of the file), the index is out of date in a way it couldn't
+    tell, so it's built again and the row read again.
+
+    Args:
+        mon: the Monday date object of the week
+        path: the history file
+
+    Returns:
+        the bytes of the row, or None if the week isn't in the history
+    """
+    for attempt in range(2):
+        index=read_history_index(path)
+        if mon not in index:
+            return None
+        offset,length=index[mon]
+        with open(path,'rb') as f:
+            f.seek(offset)
+            row=f.read(length)
+            ended=row.endswith(b'\n') or not f.read(1)
+        try:
+            if ended and _parse_history_line(row.decode())[0]==mon:
+                return row
+        except (ValueError,TypeError):
+            pass
+        os.remove(os.path.splitext(path)[0]+".idx")
+    raise ValueError("Can't find the row for {} in {}".format(mon,path))
+
+def read_week(mon,path="history.txt"):
+    """Reads one week straight out of the history file, using the index.
+
+    Args:
+        mon: the Monday date object of the week
+        path: the history file
+
+    Returns:
+        the dict mapping each person to their chore that week, or None if the
+        week isn't in the history
+    """
+    row=_read_row(mon,path)
+    if row is None:
+        return None
+    return _parse_history_line(row.decode())[1]
+
+class ChoreHistory:
+    """Who did which chore each week, compiled into a persons x weeks matrix.
+
+    Built from the history file by update_history_store, which keeps it in a
+    memory-mapped .npy file next to the history, so answering questions about
+    years of weeks doesn't mean re-reading years of rows.
+
+    Attributes:
+        names: a list of strings, everyone who appears in the history (rows)
+        chores: a list of strings, every chore that appears in the history
+        first_monday: the Monday date object of the first week (column 0)
+        ids: an int array, ids[i,w] is the position in chores of what
+            names[i] did in week w, or -1 if they did nothing that week
+    """
+
+    def __init__(self,names,chores,first_monday,ids):
+        self.names=names
+        self.chores=chores
+        self.first_monday=first_monday
+        self.ids=ids
+
+    def counts(self):
+        """Returns an int array of how many times each person did each chore,
+        shape (len(names),len(chores))."""
+        person,week=np.nonzero(self.ids>=0)
+        return np.bincount(person*len(self.chores)+self.ids[person,week],
+                minlength=len(self.names)*len(self.chores))\
+                .reshape(len(self.names),len(self.chores))
+
+    def last_done(self):
+        """Returns a datetime64 array of the Monday each person last did each
+        chore, or NaT if never, shape (len(names),len(chores))."""
+        person,week=np.nonzero(self.ids>=0)
+        last=np.full((len(self.names),len(self.chores)),-1)
+        np.maximum.at(last,(person,self.ids[person,week]),week)
+        return np.where(last>=0,
+                np.datetime64(self.first_monday)+7*last.astype('timedelta64[D]'),
+                np.datetime64('NaT'))
+
+    def never_done(self,names,chores):
+        """Finds the chores each person has never done.
+
+        Args:
+            names, chores: the people and chores to ask about
+
+        Returns:
+            knowns: a dict mapping names to never-done chores, as would be
+                returned by read_knownpeople
+        """
+        counts=self.counts()
+        done={}
+        for i,n in enumerate(self.names):
+            done[n]=set(self.chores[j] for j in np.flatnonzero(counts[i]))
+        return {n:[c for c in chores if c not in done.get(n,())]
+                for n in names}
+
+def update_history_store(path="history.txt"):
+    """Brings the compiled ChoreHistory for a history file up to date.
+
+    The matrix is kept as a .npy file next to the history (history_store.npy
+    for history.txt), along with a history_store.json noting the names and
+    chores the ids refer to and how much of the history has been compiled.
+    Only rows appended since then are read, see read_history_index.  If the
+    index had to be built again, the history may have been edited anywhere,
+    so everything is compiled again too.
+
+    Args:
+        path: the history file
+
+    Returns:
+        the ChoreHistory, memory-mapped from the .npy file
+    """
+    base=os.path.splitext(path)[0]
+    metapath,matpath=base+"_store.json",base+"_store.npy"
+    index,end,built=_history_index(path)
+
+    # Pick up where the last update left off, unless the history is new
+    # or has been rewritten since
+    meta,ids={},None
+    if os.path.exists(metapath) and os.path.exists(matpath):
+        with open(metapath,'r') as f:
+            meta=json.load(f)
+        if meta["journal_end"]<=end and meta.get("index_built")==built:
+            ids=np.lib.format.open_memmap(matpath,mode='r+')
+        else:
+            meta={}
+    if ids is None:
+        meta={"names":[],"chores":[],"first_monday":None,
+                "nweeks":0,"journal_end":0,"index_built":built}
+
+    # Read the rows that haven't been compiled yet
+    rows=[]
+    if end>meta["journal_end"]:
+        with open(path,'rb') as f:
+            f.seek(meta["journal_end"])
+            for line in f.read(end-meta["journal_end"]).splitlines():
+                if line.strip():
+                    rows+=[_parse_history_line(line.decode())]
+
+    # If any row comes before the first week, compile from scratch instead
+    if meta["first_monday"] is None:
+        if not len(rows):
+            return ChoreHistory([],[],None,np.full((0,0),-1,dtype=np.int16))
+        meta["first_monday"]=str(min(mon for mon,_ in rows))
+    first=datetime.date(*[int(x) for x in meta["first_monday"].split('-')])
+    if any(mon<first for mon,_ in rows):
+        os.remove(metapath)
+        return update_history_store(path)
+
+    # Number any new names and chores
+    name_index={n:i for i,n in enumerate(meta["names"])}
+    chore_index={c:j for j,c in enumerate(meta["chores"])}
+    for mon,assig in rows:
+        for n,c in assig.items():
+            if n not in name_index:
+                name_index[n]=len(meta["names"])
+                meta["names"]+=[n]
+            if c not in chore_index:
+                chore_index[c]=len(meta["chores"])
+                meta["chores"]+=[c]
+    weeks=[(mon-first).days//7 for mon,_ in rows]
+    nweeks=max([meta["nweeks"]]+[w+1 for w in weeks])
+
+    # Grow the matrix if needed, with room for more weeks to come
+    shape=ids.shape if ids is not None else (0,0)
+    if len(meta["names"])>shape[0] or nweeks>shape[1]:
+        grown=np.lib.format.open_memmap(matpath+".tmp",mode='w+',
+                dtype=np.int16,
+                shape=(len(meta["names"]),max(nweeks,2*shape[1])))
+        grown[:]=-1
+        grown[:shape[0],:shape[1]]=ids if ids is not None else -1
+        grown.flush()
+        del ids
+        os.replace(matpath+".tmp",matpath)
+        ids=np.lib.format.open_memmap(matpath,mode='r+')
+
+    # Fill in each week, a later row for a week replacing the whole week
+    for w,(mon,assig) in zip(weeks,rows):
+        ids[:,w]=-1
+        for n,c in assig.items():
+            ids[name_index[n],w]=chore_index[c]
+    ids.flush()
+
+    # Note how far we got
+    meta["nweeks"]=nweeks
+    meta["journal_end"]=end
+    _atomic_write(metapath,json.dumps(meta))
+    return ChoreHistory(meta["names"],meta["chores"],first,ids[:,:nweeks])
+
+def _atomic_write(path,text):
+    """Writes text (or bytes) to a file all at once, so it is never seen
+    half-written."""
+    with open(path+".tmp",'wb' if isinstance(text,bytes) else 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path+".tmp",path)
+
+def _cache_key(*parts):
+    """Hashes everything a result depends on into a key for the cache.
+
+    Args:
+        *parts: arrays, or anything that can be written as JSON
+
+    Returns:
+        the key, a hex string
+    """
+    digest=hashlib.sha256()
+    for part in parts:
+        if isinstance(part,np.ndarray):
+            digest.update(str((part.dtype.str,part.shape)).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(json.dumps(part,sort_keys=True,default=str).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _cache_get(cache,key):
+    """Looks up a result saved by _cache_put.
+
+    Args:
+        cache: the folder of saved results
+        key: as returned by _cache_key
+
+    Returns:
+        the saved result, or None if there isn't one
+    """
+    path=os.path.join(cache,key+".json")
+    try:
+        with open(path) as f:
+            value=json.load(f)
+        os.utime(path)
+    except (OSError,ValueError):
+        return None
+    return value
+
+def _cache_put(cache,key,value,max_entries=512):
+    """Saves a result, forgetting the least recently used if there are many.
+
+    Each result is a file named by its key, and looking one up touches it
+    (see _cache_get), so the oldest files are the least recently used.
+
+    Args:
+        cache: the folder of saved results
+        key: as returned by _cache_key
+        value: the result, anything that can be written as JSON
+        max_entries: the most results to keep
+    """
+    os.makedirs(cache,exist_ok=True)
+    _atomic_write(os.path.join(cache,key+".json"),json.dumps(value))
+    entries=[e for e in os.scandir(cache) if e.name.endswith(".json")]
+    if len(entries)>max_entries:
+        entries.sort(key=lambda e:e.stat().st_mtime)
+        for e in entries[:len(entries)-max_entries]:
+            os.remove(e.path)
+
+def read_knownpeople(all_chores,path="knownpeople.txt"):
     """Reads the knownpeople file and returns its contents.
 
     The new people information is in 'knownpeople.txt' and contains what chores
@@ -307,6 +1271,10 @@ def read_knownpeople(all_chores):
     a comma-separated list of chores that have never been assigned to that
     person.
 
+    Args:
+        all_chores: as returned by get_preferences
+        path: the knownpeople file to read
+
     Returns:
         knowns: a dict mapping names to never-done chores 
     """
@@ -314,7 +1282,7 @@ def read_knownpeople(all_chores):
     knowns={}
 
     # Open the file
-    with open("knownpeople.txt",'r') as f:
+    with open(path,'r') as f:
 
         # Get each row
         for l in f:
@@ -334,23 +1302,59 @@ def read_knownpeople(all_chores):
     # Success, return
     return knowns
 
-def write_knownpeople(knowns):
+def write_knownpeople(knowns,path="knownpeople.txt"):
     """Write out the new people information.
 
     Puts the contents of knowns into the knownpeople.txt file.
 
     Args:
         knowns: as returned from read_knownpeople
+        path: the knownpeople file to write
     """
 
     # Open the file
-    with open("knownpeople.txt",'w') as f:
+    with open(path,'w') as f:
 
         # Spit out each row
         for name,chores in knowns.items():
             f.write(name+":"+",".join(chores)+"\n")
 
-def get_from_current_cycle(hist,moncy,names,chores):
+# Cycle starts already parsed in this run, by their row in the history,
+# see cycle_baseline
+_cycle_baselines={}
+
+def cycle_baseline(moncy,hist=None,path="history.txt"):
+    """Returns what everyone was doing at the start of a cycle.
+
+    From the history file, the week's row is read straight out using the
+    index (see _read_row), and only parsed the first time it's seen in a
+    run.  Since it's looked up by the row itself, a row edited since is
+    parsed again.
+
+    Args:
+        moncy: as returned from weekinfo
+        hist: as returned from read_history, or None to use the file
+        path: the history file to read when hist is None
+
+    Returns:
+        a dict mapping each person to their chore that week, in the order
+        recorded, or None if the week isn't in the history
+    """
+    if hist is not None:
+        for h in reversed(hist):
+            if h[0]==moncy:
+                return dict(h[1])
+        return None
+
+    # Read the row, and parse it unless it's been seen before
+    row=_read_row(moncy,path)
+    if row is None:
+        return None
+    if row not in _cycle_baselines:
+        _cycle_baselines[row]=_parse_history_line(row.decode())[1]
+    return dict(_cycle_baselines[row])
+
+def get_from_current_cycle(hist,moncy,names,chores,path="history.txt"):
     """ Gets the chore assignments baseline for this cycle. 
 
     Checks the hist to pull the chores associated to this cycle's Monday.
@@ -361,50 +1365,49 @@ def get_from_current_cycle(hist,moncy,names,chores):
     week.
 
     Arguments:
-        hist: as returned from read_history
-        moncy: as returned from weekinfo
-        names, chores: the names and chores of interest for THIS WEEK
+        hist, moncy, path: see cycle_baseline
+        names, chores: the names and chores of interest for THIS WEEK,
+            where chores may also be an Assignment
 
     Returns:
         chores:
             a list of chores (the "baseline") ordered to correspond with
             the list of names
     """
+    if isinstance(chores,Assignment):
+        chores=chores.chores
 
-    # Extract the names & chores associated with the Monday that was
+    # Get the names & chores associated with the Monday that was
     # the beginning of this cycle.  If that doesn't exist, complain!
-    gotem=False
-    for h in reversed(hist):
-        if h[0]==moncy:
-            cc_names,cc_chores=zip(*list(h[1].items()))
-            gotem=True
-            break
-    assert gotem, "Current chore cycle doesn't exist in records"
-
-    # Select from those only the people and chores that are appropriate
-    # for this week
-    cc_names,cc_chores=\
-        [list(x) for x in
-            zip(*[(name,chore) for name,chore in
-                zip(cc_names,cc_chores) if name in names])]
-
-    # Attach a number onto the end of each wildcard chore so they are unique
+    cycle_start=cycle_baseline(moncy,hist,path)
+    assert cycle_start is not None, \
+            "Current chore cycle doesn't exist in records"
+
+    # Select from those only the people that are here this week, attaching
+    # a number onto the end of each wildcard chore so they are unique
+    here=set(names)
+    cc_chore_of={}
     nwild=0
-    for i,chore in enumerate(cc_chores):
-        if chore=="Wild":
-            nwild+=1
-            cc_chores[i]="Wild"+str(nwild)
-
-    # Copy this week's chores list so we can do the same with its wildcards
+    for name,chore in cycle_start.items():
+        if name in here:
+            if chore=="Wild":
+                nwild+=1
+                chore="Wild"+str(nwild)
+            cc_chore_of[name]=chore
+    assert len(cc_chore_of), "Nobody from the cycle start is here"
+
+    # Do the same with this week's wildcards
     chores=chores.copy()
     nwild=0
     for i,chore in enumerate(chores):
         if chore=="Wild":
             nwild+=1
             chores[i]="Wild"+str(nwild)
-    
-    # List of chores in this week but not cycle start
-    extra_chores=[chore for chore in chores if chore not in cc_chores]
+    this_week=set(chores)
+
+    # Queue of chores in this week but not cycle start
+    cc_chores=set(cc_chore_of.values())
+    extra_chores=deque(chore for chore in chores if chore not in cc_chores)
 
     # This will contain a valid chore assignment for this week
     # based on the cycle start
@@ -413,29 +1416,16 @@ def get_from_current_cycle(hist,moncy,names,chores):
     # Go through the current names in order
     for name in names:
 
-        # If person was in the cycle start
-        if name in cc_names:
-
-            # and if their chore is valid this week
-            cc_chore=cc_chores[cc_names.index(name)]
-            if cc_chore in chores:
+        # If person was in the cycle start and their chore is valid this
+        # week, then give them that chore
+        cc_chore=cc_chore_of.get(name)
+        if cc_chore in this_week:
+            new_chores+=[cc_chore]
 
-                # then given them that chore
-                new_chores+=[cc_chore]
-
-            # but if their previous chore is not valid this week
-            else:
-
-                # they get a new chore from extra_chores
-                new_chores+=[extra_chores[0]]
-                extra_chores=extra_chores[1:]
-
-        # or if they were not in the cycle start
+        # but if they were not in the cycle start, or their previous chore
+        # is not valid this week, they get a new chore from extra_chores
         else:
-
-            # they get a new chore from extra_chores
-            new_chores+=[extra_chores[0]]
-            extra_chores=extra_chores[1:]
+            new_chores+=[extra_chores.popleft()]
 
     # Strip the numbers off the wild chores
     for i,chore in enumerate(new_chores):
@@ -446,10 +1436,30 @@ def get_from_current_cycle(hist,moncy,names,chores):
     return new_chores
 
 def print_chores(names,chores):
-    """Prints a table of people and chores."""
+    """Prints a table of people and chores, which may be an Assignment."""
+    if isinstance(chores,Assignment):
+        chores=chores.chores
     for name,chore in zip(names,chores):
         print("{:5s} - {:15s}".format(name,chore))
 
+def misery_matrix(names,chores,prefs):
+    """Tabulates how each person would feel about each current chore.
+
+    Args:
+        names, chores: the current names and correspondingly ordered chores,
+            where chores may also be an Assignment
+        prefs: as returned by get_preferences
+
+    Returns:
+        W: a float array where W[i,k] is the misery names[i] would have doing
+            the chore currently held by names[k], so the diagonal is everyone's
+            current misery
+    """
+    if isinstance(chores,Assignment):
+        return chores.misery_matrix()
+    prefs=as_preferences(prefs)
+    return prefs.mat[np.ix_(prefs.rows(names),prefs.cols(chores))]
+
 def seek_loop(names,chores,prefs,
         curr_person,people_already_included=[],improvement_so_far=0,
         largeloop=True):
@@ -468,6 +1478,9 @@ def seek_loop(names,chores,prefs,
     that *already* offers some improvement to someone, ie the first person will
     not try to trade for evenly hated chores.
 
+    The search itself runs on integer positions in misery_matrix, see
+    _seek_loop, and more quickly _seek_loop_bnb.
+
     Args:
         names, chores: the current names and correspondingly ordered chores
         prefs: as returned by get_preferences
@@ -489,49 +1502,91 @@ def seek_loop(names,chores,prefs,
         (if no branch is found, returns [False,0])
 
     """
+    W=misery_matrix(names,chores,prefs)
+    loop,improvement=_seek_loop_bnb(W,names.index(curr_person),
+            [names.index(n) for n in people_already_included],
+            improvement_so_far,largeloop)
+    if loop is False:
+        return False,0
+    return [[names[i] for i in loop],float(improvement)]
+
+def _seek_loop(W,curr,included=[],improvement_so_far=0,largeloop=True,
+        visited=None,stats=None,budget=None):
+    """The recursion behind seek_loop, on positions instead of names.
+
+    Args:
+        W: as returned by misery_matrix
+        curr, included: positions of curr_person and people_already_included
+        improvement_so_far, largeloop: see seek_loop
+        visited: if supplied, a set which will collect the position of
+            everyone whose row of W the search looked at
+        stats: if supplied, a dict of counters to add to, see _search_stats
+        budget: if supplied, a _Budget which each call spends one of, so the
+            search raises _OutOfBudget, with the best loop so far, if it
+            runs out
+
+    Returns:
+        loop, improvement: as in seek_loop, but loop is a list of positions
+    """
+    if budget is not None:
+        budget.spend()
+    if visited is not None:
+        visited.add(curr)
 
-    # index of the current person in the names list, and their current misery
-    i_name=names.index(curr_person)
-    current_misery=prefs[curr_person][chores[i_name]]
+    # the current person's misery for each of the current chores
+    row=W[curr]
+    current_misery=row[curr]
 
-    # list of people whose chores the current person wants
-    desired_switches=[names[i] for i,c in enumerate(chores)\
+    # positions of people whose chores the current person wants
+    # (and don't make even trades at the beginning of a branch)
+    desired_switches=np.flatnonzero(
+            row<=current_misery-1e-10*(improvement_so_far==0)).tolist()
 
-                    # can only include people not already in the branch
-                    if (names[i] not in\
-                        [curr_person]+people_already_included[1:]) \
+    # can only include people not already in the branch
+    excluded=[curr]+included[1:]
+
+    # Count the work, if asked
+    if stats is not None:
+        stats["calls"]+=1
+        stats["branches"]+=sum(n not in excluded for n in desired_switches)
+        stats["max_depth"]=max(stats["max_depth"],len(included)+1)
 
-                    # and don't make even trades at the beginning of a branch 
-                    and prefs[curr_person][c]<=
-                        current_misery-1e-10*(improvement_so_far==0)]
-    
     # Will be a list of [loop,improvement] for possible branches
     possibilities=[]
 
     # Go through each of the potential switchees
     for n in desired_switches:
+        if n in excluded: continue
 
         # If this would form a complete loop
-        if len(people_already_included) and (n == people_already_included[0]):
+        if len(included) and (n == included[0]):
 
             # Add it to possibilities
-            possibilities+=[[people_already_included+[curr_person],
-                             improvement_so_far\
-                                 +current_misery\
-                                 -prefs[curr_person][chores[names.index(n)]]]]
+            possibilities+=[[included+[curr],
+                             improvement_so_far+current_misery-row[n]]]
+            if stats is not None:
+                stats["loops"]+=1
 
         # If we're still on the initial person
         # or we're not restricted to pairwise swaps
-        elif largeloop or (not len(people_already_included)):
-
-            # Then recurse to find the best branch from there
-            found=seek_loop(names,chores,prefs,
-                        n,people_already_included+[curr_person],\
-                     improvement_so_far\
-                        +current_misery-prefs[curr_person][chores[names.index(n)]],
-                     largeloop=largeloop)
+        elif largeloop or (not len(included)):
 
-            # If a branh is found, add it to possibilities
+            # Then recurse to find the best branch from there, passing up
+            # the best loop so far if the budget runs out
+            try:
+                found=_seek_loop(W,n,included+[curr],
+                        improvement_so_far+current_misery-row[n],
+                        largeloop=largeloop,visited=visited,stats=stats,
+                        budget=budget)
+            except _OutOfBudget as e:
+                if e.loop:
+                    possibilities+=[[e.loop,e.improvement]]
+                if not len(possibilities):
+                    raise
+                raise _OutOfBudget(*possibilities[
+                    np.argmax([p[1] for p in possibilities])]) from None
+
+            # If a branch is found, add it to possibilities
             if found[0]:
                 possibilities+=[found]
 
@@ -543,74 +1598,674 @@ def seek_loop(names,chores,prefs,
     else:
         return False,0
 
+def seek_loop_graph(names,chores,prefs,curr_person,largeloop=True):
+    """Finds a universally-agreeable chore swap in polynomial time.
+
+    A faster alternative to seek_loop for large houses.  Instead of trying
+    every branch, it treats "person u would take person v's chore" as an edge
+    u->v of a directed graph weighted by u's improvement, and looks for the
+    best-improving cycle through curr_person, see _seek_loop_graph.  The same
+    rules apply: everyone in the loop must be at least as happy, and the first
+    person will not start with an even trade.  Unlike seek_loop, the loop
+    found is not guaranteed to be the very best one available, except for
+    pairwise swaps (largeloop=False), where the search is exact.
+
+    Args:
+        names, chores, prefs, curr_person, largeloop: see seek_loop
+
+    Returns:
+        loop, improvement: see seek_loop
+    """
+    W=misery_matrix(names,chores,prefs)
+    loop,improvement=_seek_loop_graph(W,names.index(curr_person),largeloop)
+    if loop is False:
+        return False,0
+    return [[names[i] for i in loop],float(improvement)]
+
+def _seek_loop_graph(W,curr,largeloop=True,visited=None,stats=None,
+        budget=None):
+    """The graph search behind seek_loop_graph, on positions instead of names.
+
+    This is a Bellman-Ford pass over edge costs of minus the improvement, so
+    the most negative (ie most improving) cycle through curr is sought.  After
+    t rounds, best[v] is the largest improvement of a path of t+1 edges from
+    curr to v, and onpath[v] marks the people on that path, who may not be
+    revisited.  Each round every path is closed back to curr to see if it
+    makes a better loop, and then extended by one more edge.  This takes
+    O(n^3) time, rather than the exponential time of the exhaustive search.
+
+    Args:
+        W: as returned by misery_matrix
+        curr: position of the person who starts the loop
+        largeloop: see seek_loop
+        visited: see _seek_loop, though this search looks at everyone
+        stats: see _seek_loop, where a round counts as a level of depth and
+            each path extended or closed counts as a branch
+        budget: see _seek_loop, where each round spends one
+
+    Returns:
+        loop, improvement: see _seek_loop
+    """
+    n=len(W)
+    everyone=np.arange(n)
+    if visited is not None:
+        visited.update(range(n))
+    if stats is not None:
+        stats["calls"]+=1
+
+    # gain[u,v] is how much u improves by taking v's chore, and u is
+    # willing to do that as long as it isn't worse
+    current=np.diag(W)
+    gain=current[:,None]-W
+    willing=W<=current[:,None]
+    willing[everyone,everyone]=False
+    closing=np.where(W[:,curr]<=current,gain[:,curr],-np.inf)
+
+    # The first step can't be an even trade
+    best=np.where(W[curr]<=current[curr]-1e-10,gain[curr],-np.inf)
+    best[curr]=-np.inf
+    onpath=np.zeros((n,n),dtype=bool)
+    onpath[:,curr]=True
+    onpath[everyone,everyone]=True
+
+    # Will record the best loop so far as (number of rounds, last person)
+    found,best_improvement=None,0
+    preds=[]
+
+    # Walks the predecessors back to recover a loop that was found
+    def recover(found):
+        t,k=found
+        loop=[k]
+        for pred in reversed(preds[:t]):
+            loop+=[int(pred[loop[-1]])]
+        return [curr]+loop[::-1]
+
+    for t in range(n-1):
+
+        # If the budget runs out, the best loop so far is still worth having
+        if budget is not None:
+            try:
+                budget.spend()
+            except _OutOfBudget:
+                if found is None:
+                    raise
+                raise _OutOfBudget(recover(found),best_improvement) from None
+
+        # Try closing each path back to the start
+        loops=best+closing
+        k=int(np.argmax(loops))
+        if loops[k]>best_improvement:
+            found,best_improvement=(t,k),loops[k]
+        if stats is not None and np.any(np.isfinite(best)):
+            stats["branches"]+=int(np.isfinite(best).sum())
+            stats["max_depth"]=max(stats["max_depth"],t+2)
+            stats["loops"]+=int(np.isfinite(loops).sum())
+
+        # Pairwise swaps never go further than that
+        if not largeloop:
+            break
+
+        # Extend each path by the best edge that doesn't revisit anyone
+        extended=np.where(willing & ~onpath,best[:,None]+gain,-np.inf)
+        pred=np.argmax(extended,axis=0)
+        best=extended[pred,everyone]
+        if not np.any(np.isfinite(best)):
+            break
+        onpath=onpath[pred]
+        onpath[everyone,everyone]=True
+        preds+=[pred]
+
+    # Otherwise return the sad news
+    if found is None:
+        return False,0
+    return recover(found),best_improvement
+
+# Worker processes for the parallel loop search, see _search_pool
+_shared_pool=None
+
+def _search_pool():
+    """Returns the process pool for _seek_loop_parallel, starting it once."""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool=concurrent.futures.ProcessPoolExecutor()
+    return _shared_pool
+
+def _seek_loop_parallel(W,curr,largeloop=True,visited=None,stats=None,
+        budget=None):
+    """The same search as _seek_loop, spread over several processes.
+
+    Each chore the first person would rather have starts a branch which is
+    searched independently of the others, so each of these branches is
+    searched in a worker process (see _seek_branch).  The answers are then
+    put back in the same order and the best picked the same way, so the
+    result is identical to _seek_loop's.  Pairwise searches, and searches with
+    only one branch, aren't worth sending out and are done here.
+
+    Each worker gets its own copy of the budget, so a work budget (but not a
+    time budget) applies to each branch separately.
+
+    Args:
+        W, curr, largeloop, visited, stats, budget: see _seek_loop
+
+    Returns:
+        loop, improvement: see _seek_loop
+    """
+    row=W[curr]
+    current_misery=row[curr]
+    desired_switches=[n for n in
+            np.flatnonzero(row<=current_misery-1e-10).tolist() if n!=curr]
+    if not largeloop or len(desired_switches)<2:
+        return _seek_loop_bnb(W,curr,largeloop=largeloop,visited=visited,
+                stats=stats,budget=budget)
+    if budget is not None:
+        budget.spend()
+
+    # Search each branch in a worker, and if one runs out of budget,
+    # don't bother starting the rest, but keep the best loop found so far
+    futures=[_search_pool().submit(_seek_branch,W,n,[curr],
+        current_misery-row[n],largeloop,visited is not None,
+        stats is not None,budget) for n in desired_switches]
+    results=[]
+    try:
+        for future in futures:
+            results+=[future.result()]
+    except _OutOfBudget as e:
+        for future in futures:
+            future.cancel()
+        possibilities=[found for found,_,_ in results if found[0]]
+        if e.loop:
+            possibilities+=[(e.loop,e.improvement)]
+        if not len(possibilities):
+            raise
+        raise _OutOfBudget(*possibilities[
+            np.argmax([p[1] for p in possibilities])]) from None
+
+    # Gather up who was looked at and the work done
+    if visited is not None:
+        visited.add(curr)
+        for found,branch_visited,branch_stats in results:
+            visited|=branch_visited
+    if stats is not None:
+        stats["calls"]+=1
+        stats["branches"]+=len(desired_switches)
+        stats["max_depth"]=max(stats["max_depth"],1)
+        for found,branch_visited,branch_stats in results:
+            for key in ("calls","branches","loops","pruned"):
+                stats[key]+=branch_stats[key]
+            stats["max_depth"]=max(stats["max_depth"],
+                    branch_stats["max_depth"])
+
+    # Return the best, as _seek_loop would
+    possibilities=[found for found,_,_ in results if found[0]]
+    if len(possibilities):
+        return possibilities[np.argmax([p[1] for p in possibilities])]
+    else:
+        return False,0
+
+def _seek_branch(W,curr,included,improvement_so_far,largeloop,track_visited,
+        track_stats,budget=None):
+    """Searches one branch for _seek_loop_parallel, in a worker process.
+
+    Args:
+        W, curr, included, improvement_so_far, largeloop: see _seek_loop
+        track_visited, track_stats: whether to collect visited and stats
+        budget: see _seek_loop
+
+    Returns:
+        found: as returned by _seek_loop
+        visited, stats: as collected by _seek_loop, or None if not tracked
+    """
+    visited=set() if track_visited else None
+    stats={"calls":0,"branches":0,"max_depth":0,"loops":0,"pruned":0}\
+            if track_stats else None
+    found=_seek_loop_bnb(W,curr,included,improvement_so_far,largeloop,
+            visited,stats,budget)
+    return found,visited,stats
+
+def _seek_loop_bnb(W,curr,included=[],improvement_so_far=0,largeloop=True,
+        visited=None,stats=None,budget=None):
+    """The same search as _seek_loop, but without recursion, and pruned.
+
+    Gives exactly the loop and improvement _seek_loop does, ties included.
+    _seek_loop keeps the first of the best loops from each branch, which
+    comes to keeping the first loop found (going through people in order of
+    position) that beats every loop before it.  So this walks the same
+    branches in the same order with a stack, keeping the people on the
+    branch as bits of an int, and adds up the improvements in the same order
+    so that they come out the same to the last bit.
+
+    A branch is skipped when even the most it could possibly add can't catch
+    up with the best loop so far, where the most anyone not yet on the branch
+    could add is the improvement of getting the chore they most want.  If any
+    branch is skipped, its answer depends on people it never looked at, so
+    everyone is counted as visited.
+
+    Args:
+        W, curr, included, improvement_so_far, largeloop, visited, stats,
+            budget: see _seek_loop
+
+    Returns:
+        loop, improvement: see _seek_loop
+    """
+    n=len(W)
+    rows=W.tolist()
+    current=[rows[i][i] for i in range(n)]
+
+    # The most each person could gain by a swap, ignoring who else agrees
+    others=np.where(np.isnan(W),np.inf,W)
+    others[np.arange(n),np.arange(n)]=np.inf
+    most=np.nan_to_num(np.maximum(np.diag(W)-others.min(axis=1),0)).tolist()
+    tol=1e-9
+
+    # Who each person would swap with, only found when first needed, see
+    # _seek_loop: a strict improvement when nothing's been gained yet
+    wants={}
+    def desired(p,strict):
+        if (p,strict) not in wants:
+            wants[p,strict]=[m for m in np.flatnonzero(
+                W[p]<=current[p]-1e-10*strict).tolist() if m!=p]
+        return wants[p,strict]
+
+    # The branch so far: who's on it (as a list and as bits), what it has
+    # gained, and the most that everyone else could add
+    path=list(included)+[curr]
+    start=path[0]
+    onpath=0
+    for p in path:
+        onpath|=1<<p
+    remaining=sum(most)-sum(most[p] for p in path)
+    best_loop,best=False,0
+    pruned=False
+    if budget is not None:
+        budget.spend()
+    if visited is not None:
+        visited.add(curr)
+    candidates=desired(curr,improvement_so_far==0)
+    if stats is not None:
+        stats["calls"]+=1
+        stats["branches"]+=sum(not onpath>>k&1 or k==start
+                for k in candidates)
+        stats["max_depth"]=max(stats["max_depth"],len(path))
+    stack=[(curr,improvement_so_far,iter(candidates))]
+    # If the budget runs out, the best loop so far is still worth having
+    try:
+        while stack:
+            p,improvement,todo=stack[-1]
+            gained=improvement+current[p]
+            for m in todo:
+                if onpath>>m&1 and m!=start:
+                    continue
+
+                # Closing the loop, keep it if it's better than any before
+                if m==start:
+                    if len(path)>1:
+                        total=gained-rows[p][m]
+                        if stats is not None:
+                            stats["loops"]+=1
+                        if best_loop is False or total>best:
+                            best_loop,best=path.copy(),total
+                    continue
+
+                # Or carry on from m, unless that can't beat the best so far
+                if largeloop or len(path)==1:
+                    total=gained-rows[p][m]
+                    if best_loop is not False and total+remaining<best-tol:
+                        pruned=True
+                        if stats is not None:
+                            stats["pruned"]+=1
+                        continue
+                    if budget is not None:
+                        budget.spend()
+                    if visited is not None:
+                        visited.add(m)
+                    candidates=desired(m,total==0)
+                    if stats is not None:
+                        stats["calls"]+=1
+                        stats["branches"]+=sum(not onpath>>k&1 or k==start
+                                for k in candidates)
+                        stats["max_depth"]=max(stats["max_depth"],len(path)+1)
+                    path.append(m)
+                    onpath|=1<<m
+                    remaining-=most[m]
+                    stack.append((m,total,iter(candidates)))
+                    break
+
+            # Nothing left to try from p, so back up
+            else:
+                stack.pop()
+                path.pop()
+                onpath&=~(1<<p)
+                remaining+=most[p]
+    except _OutOfBudget:
+        raise _OutOfBudget(best_loop,best) from None
+
+    if pruned and visited is not None:
+        visited.update(range(n))
+    return best_loop,best
+
+def _seek_swap(W,curr,largeloop=False,visited=None,stats=None,budget=None):
+    """The same search as _seek_loop for pairwise swaps, all at once.
+
+    With largeloop=False, _seek_loop only ever tries swapping curr's chore
+    with each person j whose chore curr strictly wants, and takes the swap if
+    j is no worse off.  So instead of going through them one by one, this
+    works out curr's row and column of the gain matrix, ie diag(W)-W, for
+    everyone at once, and picks the first of the best mutually agreeable
+    swaps.  The improvements are added up in the same order as _seek_loop
+    does, so they come out exactly the same.
+
+    Args:
+        W, curr, visited, stats, budget: see _seek_loop
+        largeloop: if True, hands over to _seek_loop_bnb
+
+    Returns:
+        loop, improvement: see _seek_loop
+    """
+    if largeloop:
+        return _seek_loop_bnb(W,curr,largeloop=True,visited=visited,
+                stats=stats,budget=budget)
+    current=np.diag(W)
+
+    # Whose chores curr strictly wants, and which of them would swap back
+    wanted=W[curr]<=current[curr]-1e-10
+    wanted[curr]=False
+    agreed=wanted & (W[:,curr]<=current)
+    improvement=(0+current[curr]-W[curr])+current-W[:,curr]
+    candidates=np.flatnonzero(wanted)
+
+    # Count the work as _seek_loop would
+    if budget is not None:
+        budget.spend(1+len(candidates))
+    if visited is not None:
+        visited.add(curr)
+        visited.update(candidates.tolist())
+    if stats is not None:
+        stats["calls"]+=1+len(candidates)
+        stats["branches"]+=len(candidates)+int(
+                np.sum(W[candidates]<=current[candidates,None])
+                -np.sum(current[candidates]<=current[candidates]))
+        stats["max_depth"]=max(stats["max_depth"],
+                2 if len(candidates) else 1)
+        stats["loops"]+=int(agreed.sum())
+
+    # Otherwise return the sad news
+    if not agreed.any():
+        return False,0
+    j=int(np.argmax(np.where(agreed,improvement,-np.inf)))
+    return [curr,j],improvement[j]
+
 def misery(names,chores,prefs):
     """Computes the total misery of this chore assignment."""
-    return sum(prefs[n][c] for n,c in zip(names,chores))/len(chores)
+    if isinstance(chores,Assignment):
+        return chores.misery()
+    return float(np.trace(misery_matrix(names,chores,prefs)))/len(chores)
+
+def _figure():
+    """Makes a new matplotlib Figure, importing matplotlib the first time.
+
+    The Figure is not tracked by pyplot, so every chart starts blank, nothing
+    piles up between charts, and it's freed once saved.  Without pyplot
+    there's no GUI backend to set up either, which suits headless runs.
+    """
+    from matplotlib.figure import Figure
+    return Figure()
 
-def show_arrangement(names,chores,prefs):
+def show_arrangement(names,chores,prefs,path="Misery.png",fmt=None):
     """Makes a misery bar chart in Misery.png.
     
     Args:
-        names, chores: the current chore assignment
+        names, chores: the current chore assignment, where chores may also be
+            an Assignment
         prefs: as returned by get_preferences
+        path: where to save the chart
+        fmt: the image format, eg "png" or "svg", default from the path
     """
-    plt.bar(names,[prefs[n][chores[i]] for i,n in enumerate(names)])
-    plt.ylim(0,len(chores))
-    plt.ylabel("Misery")
-    plt.savefig("Misery.png")
-
-def show_improvement(names,chores,oldchores,prefs):
+    if isinstance(chores,Assignment):
+        chores=chores.chores
+    prefs=as_preferences(prefs)
+    fig=_figure()
+    ax=fig.subplots()
+    ax.bar(names,prefs.mat[prefs.rows(names),prefs.cols(chores)])
+    ax.set_ylim(0,len(chores))
+    ax.set_ylabel("Misery")
+    fig.savefig(path,format=fmt)
+    fig.clear()
+
+def show_improvement(names,chores,oldchores,prefs,path="Misery.png",
+        fmt=None):
     """Makes a misery chart in Misery.png comparing old and new assignment.
     
     Args:
         names, chores: the current chore assignment
         oldchores: the unimproved assignment
         prefs: as returned by get_preferences
+        path: where to save the chart
+        fmt: the image format, eg "png" or "svg", default from the path
+
+    Either assignment may also be an Assignment.
     """
+    if isinstance(chores,Assignment):
+        chores=chores.chores
+    if isinstance(oldchores,Assignment):
+        oldchores=oldchores.chores
+    prefs=as_preferences(prefs)
+    rows=prefs.rows(names)
     ind=np.arange(len(names))
     width=.35
-    plt.bar(ind,[prefs[n][oldchores[i]] for i,n in enumerate(names)],
+    fig=_figure()
+    ax=fig.subplots()
+    ax.bar(ind,prefs.mat[rows,prefs.cols(oldchores)],
             width,color='lightcoral',label='Before swap')
-    plt.bar(ind+width,[prefs[n][chores[i]] for i,n in enumerate(names)],
+    ax.bar(ind+width,prefs.mat[rows,prefs.cols(chores)],
             width,color='deepskyblue',label='After swap')
-    plt.xticks(ind+width/2,names)
-    plt.legend(loc='best')
-    plt.ylim(0,np.max([np.max(list(prefs[n].values())) for n in names]))
-    plt.ylabel("Misery")
+    ax.set_xticks(ind+width/2)
+    ax.set_xticklabels(names)
+    ax.legend(loc='best')
+    ax.set_ylim(0,np.max(prefs.mat[rows]))
+    ax.set_ylabel("Misery")
     for i,n,c,oc in zip(ind,names,chores,oldchores):
-        plt.text(i,0.1,oc,rotation=90,ha='center',va='bottom')
-        plt.text(i+width,0.1,c,rotation=90,ha='center',va='bottom')
-    plt.savefig("Misery.png")
-    
+        ax.text(i,0.1,oc,rotation=90,ha='center',va='bottom')
+        ax.text(i+width,0.1,c,rotation=90,ha='center',va='bottom')
+    fig.savefig(path,format=fmt)
+    fig.clear()
+
+# Renders charts one at a time behind the main thread, see render_later
+_chart_thread=concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def render_later(chart,*args,**kwargs):
+    """Starts making a chart in the background.
+
+    Args:
+        chart: show_arrangement or show_improvement
+        *args, **kwargs: passed on to chart
+
+    Returns:
+        a Future, whose result() waits for the chart to be saved
+    """
+    def render():
+        with phase("chart"):
+            chart(*args,**kwargs)
+    return _chart_thread.submit(render)
+
+def render_charts(jobs,outdir=".",fmt="png",workers=None):
+    """Makes many improvement charts at once, in parallel worker processes.
+
+    Args:
+        jobs: a dict mapping the name of each chart (eg a house or week) to
+            a tuple of the (names,chores,oldchores,prefs) to pass to
+            show_improvement
+        outdir: the folder to put them in, as NAME.FMT
+        fmt: the image format, eg "png" or "svg"
+        workers: how many worker processes, default one per core
+
+    Returns:
+        a dict mapping the name of each chart to where it was saved
+    """
+    os.makedirs(outdir,exist_ok=True)
+    paths={name:os.path.join(outdir,name+"."+fmt) for name in jobs}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures=[pool.submit(show_improvement,*args,path=paths[name],fmt=fmt)
+                for name,args in jobs.items()]
+        for future in futures:
+            future.result()
+    return paths
+
+class _OutOfBudget(Exception):
+    """Raised from a loop search when improve()'s budget has run out.
+
+    Args:
+        loop, improvement: the best loop the search had found so far, as it
+            would have returned them, or False and 0 if none
+    """
+    def __init__(self,loop=False,improvement=0):
+        super().__init__(loop,improvement)
+        self.loop=loop
+        self.improvement=improvement
+
+class _Budget:
+    """How much more time and work improve() may spend.
+
+    Progress is printed every tenth of the budget, so that a long search
+    isn't silent.
 
-def improve(names,chores,prefs,restricted_askers=None,largeloop=True):
+    Args:
+        seconds: the most wall time to spend, or None for no limit
+        calls: the most loop search calls to make, or None for no limit
+    """
+    def __init__(self,seconds=None,calls=None):
+        self.seconds=seconds
+        self.start=time.monotonic()
+        self.deadline=None if seconds is None else self.start+seconds
+        self.calls=calls
+        self.calls_left=calls
+        self.next_report=0.1
+
+    def spend(self,calls=1):
+        """Counts some search calls, raising _OutOfBudget if over budget."""
+        if self.spent()>=self.next_report:
+            print("{:.0%} of the budget spent".format(self.next_report),
+                    flush=True)
+            self.next_report+=0.1
+        if self.calls_left is not None:
+            self.calls_left-=calls
+            if self.calls_left<0:
+                raise _OutOfBudget()
+        if self.deadline is not None and time.monotonic()>self.deadline:
+            raise _OutOfBudget()
+
+    def spent(self):
+        """The fraction of the budget spent, in time or work if more so."""
+        fractions=[0]
+        if self.seconds is not None:
+            fractions+=[(time.monotonic()-self.start)/max(self.seconds,1e-9)]
+        if self.calls is not None:
+            fractions+=[(self.calls-self.calls_left)/max(self.calls,1)]
+        return min(max(fractions),1)
+
+# The loop-seeking engines improve() can use, see _seek_loop_bnb,
+# _seek_loop_parallel, _seek_loop_graph and _seek_loop (which gives the same
+# answers as the first two, but much more slowly)
+engines={"dfs":_seek_loop_bnb,"parallel":_seek_loop_parallel,
+        "graph":_seek_loop_graph,"recursive":_seek_loop,"pairwise":_seek_swap}
+
+def improve(names,chores,prefs,restricted_askers=None,largeloop=True,
+        engine="dfs",budget=None,max_calls=None,cache=None,outcome=None):
     """Seeks to find the universally agreeable swaps available.
 
     Essentially calls seek_loop for everyone in the list on repeat until
     every call comes up empty.  The order to go through and ask people to seek
     loops is determined by who has the most misery, which gives them a first
-    chance to improve their lot.
+    chance to improve their lot.  A person's search is only redone if a trade
+    since their last one could have changed its answer.
+
+    Given a budget, it stops as soon as that runs out, even in the middle of
+    a search (after making the best trade that search had found so far), and
+    returns the assignment after the trades made so far, which is always at
+    least as good for everyone as the one it started with.
 
     Args:
-        names, chores: the current chore assignment
+        names, chores: the current chore assignment, where chores may be a
+            list or an Assignment
         prefs: as returned from get_preferences
         restricted_askers: if supplied, these are the only people who will try
             to start seeking a loop
         largeloop: see seek_loop, can force only pairwise swaps
+        engine: which loop search to use, "dfs" for the exhaustive seek_loop
+            (see _seek_loop_bnb), "parallel" for the same search spread over
+            every core (see _seek_loop_parallel), or "graph" for the
+            polynomial-time seek_loop_graph, which is much faster for large
+            houses but may settle for smaller loops.  With largeloop=False,
+            "dfs" uses the same answers from the quicker "pairwise" search,
+            see _seek_swap
+        budget: if supplied, the most seconds to spend
+        max_calls: if supplied, the most loop search calls to make, see
+            _Budget
+        cache: if supplied, a folder to save the trades in, so that the same
+            improvement needn't be worked out again.  The trades only depend
+            on everyone's misery for the current chores (see misery_matrix),
+            the askers and the kind of search, so that's what they're saved
+            under, and any change to those is a fresh start.  Unfinished
+            improvements (see budget) aren't saved
+        outcome: if supplied, a dict that's filled in with "converged",
+            whether every trade was found before the budget ran out
+
+    Returns:
+        chores: the improved chores, a list ordered to correspond with names,
+            or a new Assignment if given one
     """
-    # Copy the current chores list so we don't change an argument
-    chores=chores.copy()
+    seek=engines[engine]
+    if engine=="dfs" and not largeloop:
+        seek=_seek_swap
+
+    # Stop early if the budget runs out
+    spend=None
+    if budget is not None or max_calls is not None:
+        spend=_Budget(budget,max_calls)
+    converged=True
+
+    # Copy the current assignment so we don't change an argument
+    given_assignment=isinstance(chores,Assignment)
+    if given_assignment:
+        assignment=chores.copy()
+    else:
+        assignment=Assignment(names,chores,prefs)
+
+    # Everyone's misery for the chores as now assigned
+    W=assignment.misery_matrix()
+    pos=assignment.position
 
     # List of people who can start loops
     restricted_askers=restricted_askers if restricted_askers else names
 
     # Order the list of loop starters by current misery
-    asking_order=list(sorted(restricted_askers,
-        key=lambda n:-prefs[n][chores[names.index(n)]]))
+    asking_order=[pos[n] for n in sorted(restricted_askers,
+        key=lambda n:-W[pos[n],pos[n]])]
+
+    # If this was worked out before, just make the same trades.  All the
+    # engines but graph give the same answers
+    if cache is not None:
+        key=_cache_key("improve",W,asking_order,largeloop,
+                "graph" if engine=="graph" else "exact")
+        moves=_cache_get(cache,key)
+        if moves is not None:
+            print("Reusing the trades worked out before")
+            assignment.permute(moves)
+            print("Current misery: ",assignment.misery())
+            if outcome is not None:
+                outcome["converged"]=True
+            return assignment if given_assignment else assignment.chores
+        holder_before=assignment.holder.copy()
+
+    # The last loop each asker found, and who the search looked at
+    found={}
+
+    # Counts of the work done, for the trace
+    start=time.perf_counter()
+    passes,searches,trades=0,0,0
 
     # Records of misery updating after each swap
-    historical_misery=[misery(names,chores,prefs)]
-    print("Current misery: ",misery(names,chores,prefs))
+    historical_misery=[assignment.misery()]
+    print("Current misery: ",historical_misery[-1])
 
 
     # Keep trying to make trades
@@ -618,153 +2273,464 @@ def improve(names,chores,prefs,restricted_askers=None,largeloop=True):
 
         # Resets to False after every pass through the asking order
         made_trade=False
+        passes+=1
+        if spend is not None:
+            print("Pass {}, {:.0%} of the budget spent".format(passes,
+                spend.spent()),flush=True)
         for n in asking_order:
 
-            # Did we find one?
-            loop,improvement  =\
-                    seek_loop(names,chores,prefs,n,largeloop=largeloop)
+            # Stop once the budget has run out
+            if not converged:
+                break
+
+            # Did we find one?  Reuse the last answer if nothing it
+            # depended on has been traded since
+            if n not in found:
+                visited=set()
+                stats=None
+                if _trace is not None:
+                    stats=_search_stats(names[n])
+                    stats["searches"]+=1
+                try:
+                    loop,improvement=seek(W,n,largeloop=largeloop,
+                            visited=visited,stats=stats,budget=spend)
+                except _OutOfBudget as e:
+                    print("Out of budget, keeping the trades so far")
+                    converged=False
+                    loop,improvement=e.loop,e.improvement
+                found[n]=loop,visited
+                searches+=1
+            loop,visited=found[n]
             if not loop: continue
 
-            # If so, update the chores list
-            print("Executing trade ","  <-  ".join(loop+[loop[0]]))
-            nchore = chores[names.index(n)]
-            for nget,ngive in zip(loop[:-1],loop[1:]):
-                chores[names.index(nget)]=chores[names.index(ngive)]
-            chores[names.index(loop[-1])]=nchore
+            # If so, update the assignment, each person in the loop taking
+            # the chore (and so the misery column) of the next
+            print("Executing trade ",
+                    "  <-  ".join(names[i] for i in loop+[loop[0]]))
+            assignment.rotate(loop)
+            W[:,loop]=W[:,loop[1:]+loop[:1]]
+
+            # Forget the answers this trade may have changed
+            for m in list(found):
+                if not _loop_search_unchanged(W,m,found[m][1],loop,largeloop):
+                    del found[m]
 
             # And update the misery records
-            historical_misery+=[misery(names,chores,prefs)]
-            print("Current misery: ",misery(names,chores,prefs))
+            historical_misery+=[assignment.misery()]
+            print("Current misery: ",historical_misery[-1])
             made_trade=True
+            trades+=1
 
         # If we made it through a full round of asking order with no trades
-        if not made_trade:
+        # (or ran out of budget)
+        if not made_trade or not converged:
 
             # Then we're done
             break
 
+    # Note the work done, if tracing
+    if _trace is not None:
+        _trace["improve"]+=[{"engine":engine,"largeloop":largeloop,
+            "askers":[names[n] for n in asking_order],"passes":passes,
+            "searches":searches,"trades":trades,"converged":converged,
+            "misery":[float(m) for m in historical_misery],
+            "seconds":round(time.perf_counter()-start,6)}]
+
+    # Remember the trades, as who got whose chore
+    if cache is not None and converged:
+        _cache_put(cache,key,holder_before[assignment.slot].tolist())
+
     # Success, return
-    return chores
+    if outcome is not None:
+        outcome["converged"]=converged
+    return assignment if given_assignment else assignment.chores
 
-def make_email(names,chores,weekno,mon):
-    """Writes out and opens the email for the given assignment.
-   
-    Outputs to a file called email.html the contents of a message to the house
-    about chore assignments.  Calls "google-chrome" to open that file in the
-    browser.  This last part works on my system (Ubuntu linux with Chrome
-    installed), but may have to be tweaked to generalize.  If it doesn't work
-    for you, oh well, just open this folder and double-click email.html.
+def _loop_search_unchanged(W,asker,visited,loop,largeloop):
+    """Checks whether a trade leaves an earlier loop search's answer alone.
+
+    A search only depends on the rows of W for the people it visited, and a
+    trade only changes the chores of the people in the loop.  So the answer
+    still holds if nobody visited was in the trade, and nobody visited would
+    now want one of the traded chores (anyone who wanted the old ones would
+    have been visited).  With pairwise swaps only the asker's wants matter.
 
     Args:
-        names, chores: the chore assignment
-        weekno: as returned by weekinfo
+        W: as returned by misery_matrix, after the trade
+        asker: position of the person who started the search
+        visited: as collected by _seek_loop for that search
+        loop: positions of the people in the trade
+        largeloop: see seek_loop
+
+    Returns:
+        True if the search would give the same answer again
+    """
+    if not visited.isdisjoint(loop):
+        return False
+    if np.any(W[asker,loop]<=W[asker,asker]-1e-10):
+        return False
+    if largeloop:
+        others=list(visited-{asker})
+        if np.any(W[np.ix_(others,loop)]<=np.diag(W)[others,None]):
+            return False
+    return True
+
+def improve_globally(names,chores,prefs,compare=True,engine="dfs",
+        budget=None):
+    """Finds the least miserable assignment that leaves no one worse off.
+
+    Unlike improve(), which only executes loops of swaps one at a time, this
+    solves for the assignment of the current chores with the minimum total
+    misery in one go (see _linear_assignment).  The same guarantee holds:
+    nobody may end up with a chore they like less than the one they have now,
+    so the result is still a Pareto improvement over the given baseline.
+    Among equally good assignments, people stay on their own chores.
+
+    Args:
+        names, chores: the current chore assignment
+        prefs: as returned from get_preferences
+        compare: if True, also runs improve() and reports how much better
+            the global optimum is than loop-swapping
+        engine, budget: see improve, used for the comparison, which is
+            reported as it stands if the budget runs out
+
+    Returns:
+        chores: the improved chores, ordered to correspond with names
     """
-    with open("email.html",'w') as f:
+    W=misery_matrix(names,chores,prefs)
+    print("Current misery: ",np.trace(W)/len(chores))
+
+    # Forbid any chore someone likes less than their current one.  Staying
+    # put is always allowed, so a big enough cost means it's never chosen.
+    n=len(W)
+    forbidden=W>np.diag(W)[:,None]
+    cost=np.where(forbidden,n*np.max(W,initial=0)+1,W)+1e-9*(1-np.eye(n))
+
+    # Solve and print the result
+    new_chores=[chores[k] for k in _linear_assignment(cost)]
+    new_misery=misery(names,new_chores,prefs)
+    print("Globally optimal misery: ",new_misery)
+
+    # See what the loop-swapping would have given
+    if compare:
+        outcome={"converged":True}
+        with contextlib.redirect_stdout(io.StringIO()):
+            loop_misery=misery(names,improve(names,chores,prefs,engine=engine,
+                    budget=budget,outcome=outcome),prefs)
+        if outcome["converged"]:
+            print("Loop-swapping would reach misery: ",loop_misery)
+        else:
+            print("Loop-swapping reached misery (before running out of "
+                    "time): ",loop_misery)
+        print("Total gain over loop-swapping: ",
+                (loop_misery-new_misery)*len(chores))
+
+    # Success, return
+    return new_chores
 
-        # Get the date of this upcoming Friday
-        friday=mon+datetime.timedelta(4-mon.weekday())
+def _linear_assignment(cost):
+    """Solves the assignment problem with the Hungarian algorithm.
 
-        # Write the title with this Friday's date
-        f.write("<html><head><title>Chores "\
-                +friday.strftime("%m/%d")+"</title></head>")
-        f.write("<h1>Chore Assignments "\
-                +friday.strftime("%m/%d")+"</h1>")
+    This is the O(n^3) shortest-augmenting-path form: rows are added one at
+    a time, and each is routed to a free column along the cheapest path of
+    reassignments, with the potentials u and v keeping reduced costs
+    non-negative.
+
+    Args:
+        cost: a square float array, cost[i,j] of assigning row i to column j
+
+    Returns:
+        assigned: an int array, assigned[i] is the column for row i
+    """
+    n=len(cost)
+
+    # Potentials, and the row matched to each column, with a dummy column 0
+    # for the row being added and everything shifted up by one
+    u,v=np.zeros(n+1),np.zeros(n+1)
+    match=np.zeros(n+1,dtype=int)
+    way=np.zeros(n+1,dtype=int)
+
+    for i in range(1,n+1):
+        match[0]=i
+        j0=0
+        minv=np.full(n+1,np.inf)
+        used=np.zeros(n+1,dtype=bool)
+
+        # Grow the tree of reassignments until it reaches a free column
+        while True:
+            used[j0]=True
+            i0=match[j0]
+            free=~used
+            reduced=np.full(n+1,np.inf)
+            reduced[1:]=cost[i0-1]-u[i0]-v[1:]
+            better=free & (reduced<minv)
+            minv[better]=reduced[better]
+            way[better]=j0
+            j1=int(np.argmin(np.where(free,minv,np.inf)))
+            delta=minv[j1]
+            u[match[used]]+=delta
+            v[used]-=delta
+            minv[free]-=delta
+            j0=j1
+            if match[j0]==0:
+                break
+
+        # Reassign along the path back to the dummy column
+        while j0:
+            j1=way[j0]
+            match[j0]=match[j1]
+            j0=j1
+
+    assigned=np.zeros(n,dtype=int)
+    assigned[match[1:]-1]=np.arange(n)
+    return assigned
+
+# The email, with a blank for each part that changes week to week
+email_template=string.Template(
+        "<html><head><title>Chores $friday</title></head>"
+        "<h1>Chore Assignments $friday</h1>"
 
         # Greeting
-        f.write("Hi Housemates,<br/><br/>")
-        f.write("Below are this weekend's chore assignments!<br/>")
+        "Hi Housemates,<br/><br/>"
+        "Below are this weekend's chore assignments!<br/>"
 
         # Advisory about the week number in the cycle
-        if (weekno%4)+1==4:
-            f.write("(Last week of this cycle,"\
-                    " so make sure once-per-rotation items get done!)"\
-                    "<br/><br/>")
-        else:
-            f.write("(Week #"+str((weekno%4)+1)+" of this chore cycle.)"\
-                    "<br/><br/>")
-        
+        "$advisory<br/><br/>"
+
         # Table of chores
-        f.write("<table>")
-        f.write("<tr><th>{:5s}</th><th>{:15s}</th></tr>"\
-                .format("Name","Chore"))
-        for name,chore in zip(names,chores):
-           f.write("<tr><td>{:5s}</td><td>{:15s}</td></tr>"\
-                   .format(name,chore))
-        f.write("</table><br/>")
-
-        # Link to the misery spreadsheet
-        f.write("Your <a href='"+tsv_url.split("/export?")[0]+\
-                "'>chore preferences</a>"\
-                " can be updated at any time.<br/><br/>")
+        "<table>"
+        "<tr><th>Name </th><th>Chore          </th></tr>"
+        "$rows"
+        "</table><br/>"
+
+        # Link to the misery spreadsheet, if there is one
+        "${link}"
 
         # Signoff
-        f.write("Cheers,<br/>House Manager")
+        "Cheers,<br/>House Manager"
+
+        # Styling for the table
+        "<style>"
+        "table {border-collapse: collapse;}"
+        "td {border: 1px solid #ddd;}"
+        "th{background-color: skyblue;}"
+        "tr:nth-child(even){background-color: #f2f2f2;}"
+        "</style></html>")
+
+def render_email(names,chores,weekno,mon,url=None):
+    """Fills in email_template for the given assignment.
+
+    Args:
+        names, chores, weekno, mon, url: see make_email
+
+    Returns:
+        the email, as a string of HTML
+    """
+    url=tsv_url if url is None else url
+
+    # Get the date of this upcoming Friday
+    friday=mon+datetime.timedelta(4-mon.weekday())
+
+    # Advisory about the week number in the cycle
+    if (weekno%4)+1==4:
+        advisory="(Last week of this cycle,"\
+                " so make sure once-per-rotation items get done!)"
+    else:
+        advisory="(Week #"+str((weekno%4)+1)+" of this chore cycle.)"
+
+    return email_template.substitute(
+            friday=friday.strftime("%m/%d"),
+            advisory=advisory,
+            rows="".join("<tr><td>{:5s}</td><td>{:15s}</td></tr>"
+                .format(name,chore) for name,chore in zip(names,chores)),
+            link="Your <a href='{}'>chore preferences</a>"
+                " can be updated at any time.<br/><br/>"
+                .format(url.split("/export?")[0]) if url else "")
+
+def make_email(names,chores,weekno,mon,path="email.html",preview=True,
+        url=None):
+    """Writes out and opens the email for the given assignment.
+   
+    Outputs to a file called email.html the contents of a message to the house
+    about chore assignments.  Calls "google-chrome" to open that file in the
+    browser, without waiting for it.  This last part works on my system
+    (Ubuntu linux with Chrome installed), but may have to be tweaked to
+    generalize.  If it doesn't work for you, oh well, just open this folder
+    and double-click email.html.
 
-        # Styling for the table 
-        f.write("<style>")
-        f.write("table {border-collapse: collapse;}")
-        f.write("td {border: 1px solid #ddd;}")
-        f.write("th{background-color: skyblue;}")
-        f.write("tr:nth-child(even){background-color: #f2f2f2;}")
-        f.write("</style></html>")
+    Args:
+        names, chores: the chore assignment
+        weekno: as returned by weekinfo
+        mon: the Monday date object for this week
+        path: where to write the email
+        preview: whether to try opening the email in a browser
+        url: the link to the preference spreadsheet, if not tsv_url, or ""
+            to leave the link out
+    """
+    _atomic_write(path,render_email(names,chores,weekno,mon,url))
 
     # Try to open the email in a browser
-    os.system("google-chrome email.html")
+    if preview:
+        if shutil.which("google-chrome"):
+            subprocess.Popen(["google-chrome",path],
+                    stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,
+                    start_new_session=True)
+        else:
+            print("Open "+path+" in a browser to see the email.")
 
-def add_to_history(hist,mon,names,chores):
+def make_emails(jobs,outdir="."):
+    """Writes out emails for many houses or weeks at once, without opening
+    them.
+
+    Args:
+        jobs: a dict mapping the name of each email (eg a house or week) to
+            a tuple of the (names,chores,weekno,mon) or
+            (names,chores,weekno,mon,url) to pass to make_email
+        outdir: the folder to put them in, as NAME.html
+
+    Returns:
+        a dict mapping the name of each email to where it was saved
+    """
+    os.makedirs(outdir,exist_ok=True)
+    paths={}
+    for name,args in jobs.items():
+        paths[name]=os.path.join(outdir,name+".html")
+        _atomic_write(paths[name],render_email(*args))
+    return paths
+
+def add_to_history(hist,mon,names,chores,path="history.txt"):
     """Adds a new chore assignment to the history.
 
-    See read_history() for the format of the file.
+    See read_history() for the format of the file.  The new row is appended
+    in a single write and then indexed (see read_history_index), so saving
+    never rewrites the file.  If this week is already recorded, the new row
+    overwrites it as far as any reader is concerned.
 
     Args:
-        hist: the current history as returned by read_history
+        hist: the current history as returned by read_history, which is also
+            updated, or None if it wasn't read
         mon: the Monday date object for this week
         names, chores: the new chore assignment
+        path: the history file to add to
     """
+    index,end,built=_history_index(path)
 
     # If this week is already recorded in history, overwrite it
-    if len(hist) and hist[-1][0]==mon:
+    if mon in index:
         print("Overwriting this week in history")
-        hist[-1]=[mon,dict(zip(names,chores))]
-
-    # Otherwise add it to the hist object
     else:
         print("Adding this week into history")
-        hist+=[  [mon,dict(zip(names,chores))]]
-
-    # Make a backup of the history.txt file
-    if os.path.exists("history.txt"):
-        shutil.copyfile('history.txt','history_bk'+str(datetime.date.today())+'.txt')
-
-    # Output to the file
-    with open("history.txt",'w') as f:
-        for line in hist:
-            print(str(line[0])+','+','.join([k+':'+v for k,v in line[1].items()]),file=f)
-
 
-def main():
-    """Runs everything as described at the top."""
+    # Update the hist object to match
+    if hist is not None:
+        if len(hist) and hist[-1][0]==mon:
+            hist[-1]=[mon,dict(zip(names,chores))]
+        else:
+            hist+=[  [mon,dict(zip(names,chores))]]
+
+    # Note that a save is starting, starting the index if the history is new
+    if built is None:
+        built=time.time_ns()
+        open(os.path.splitext(path)[0]+".idx",'w').close()
+    _restamp_history_index(path,built,saving_from=end)
+
+    # Drop any partial row left by an interrupted save, and make sure the
+    # last row is finished off
+    line=(str(mon)+','+','.join([k+':'+v for k,v in zip(names,chores)])
+            +'\n').encode()
+    if end:
+        with open(path,'rb') as f:
+            f.seek(end-1)
+            if f.read(1)!=b'\n':
+                line=b'\n'+line
+    with open(path,'ab') as f:
+        f.truncate(end)
+
+        # Then append the row in one go
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    if line.startswith(b'\n'):
+        end,line=end+1,line[1:]
+
+    # And index it
+    with open(os.path.splitext(path)[0]+".idx",'a') as f:
+        f.write("{} {} {}\n".format(mon,end,len(line)))
+    _restamp_history_index(path,built)
+
+
+def plan_week(names,chores,prefs,weekno,fourweekno,moncy,hist=None,
+        optimizer="loops",history_path="history.txt",engine="dfs",
+        weekly_chores=('Wild','Lawn','Dishes'),compare=True,budget=None,
+        plans=None,cache=None):
+    """Works out this week's chore assignment.
+
+    At the start of a cycle the chores are rotated and then fully improved.
+    Otherwise the cycle start is applied to this week, the weekly chores are
+    bumped along, and anyone disturbed by that gets to seek pairwise swaps.
+    If the week was already planned by plan_cycle, that plan is used instead.
 
-    # Get the preferences from the Misery spreadsheet
-    all_names, all_chores, prefs, knowns =get_preferences()
+    Args:
+        names, chores: the people and chores for this week, leaving out any
+            specific assignments, as returned by get_current_situation
+        prefs: as returned by get_preferences
+        weekno, fourweekno, moncy: as returned by weekinfo
+        hist: see get_from_current_cycle
+        optimizer: see main
+        history_path: the history file to find the cycle start in
+        engine: see improve
+        weekly_chores: the chores that get bumped to the next person every
+            week instead of lasting the whole cycle
+        compare: see improve_globally
+        budget: see improve, if it runs out the week goes ahead with the
+            trades found so far
+        plans: the folder of saved cycle plans to look in, see planned_week
+        cache: if supplied, a folder to save the week's assignment in, so
+            that running the same week again (eg after cancelling) is
+            instant.  It's saved under everything the assignment depends on:
+            the people and chores, their misery for those chores, the week,
+            the cycle start and the policy.  Improvements are also saved
+            there, see improve
 
-    # Narrow down to what people and chores we want this week
-    names, chores, force_names, force_chores=\
-            get_current_situation(all_names,all_chores)
-    del all_names, all_chores
-    print("\n\n")
+    Returns:
+        chores: the improved chores, ordered to correspond with names
+        oldchores: the chores before improvement
+    """
 
-    # Get the info for this week and the history
-    fourweekno,weekno,mon,moncy=weekinfo()
-    hist=read_history()
+    # Use the plan for this week if there is one that still fits
+    if plans is not None:
+        planned=planned_week(weekno%4,moncy,names,chores,prefs,hist,
+                history_path,plans,optimizer=optimizer,engine=engine,
+                weekly_chores=weekly_chores)
+        if planned is not None:
+            print("Using the assignment planned for this week")
+            return planned
+
+    # Or if this week was worked out before, with everything the same
+    if cache is not None:
+        prefs=as_preferences(prefs)
+        try:
+            baseline=list(cycle_baseline(moncy,hist,history_path).items()) \
+                    if weekno%4 else None
+        except Exception:
+            baseline=None
+        key=_cache_key("week",names,chores,
+                prefs.mat[np.ix_(prefs.rows(names),
+                    prefs.cols(list(dict.fromkeys(chores))))],
+                weekno,fourweekno,baseline,optimizer,
+                "graph" if engine=="graph" else "exact",list(weekly_chores))
+        cached=_cache_get(cache,key)
+        if cached is not None:
+            print("Reusing the assignment worked out before for this week")
+            return cached[0],cached[1]
 
     # If it's the start of a cycle, rotate chores by the fourweekno
     # then be prepared to do a full Pareto improvement
     if (weekno % 4)==0:
         print("It's the start of a chore cycle")
-        chores=deque(chores)
-        chores.rotate(fourweekno % len(chores))
-        chores=list(chores)
+        with phase("rotation"):
+            chores=deque(chores)
+            chores.rotate(fourweekno % len(chores))
+            chores=list(chores)
         do_full_improvement=True
     
     # Otherwise, get the chores from the beginning of the cycle
@@ -773,16 +2739,19 @@ def main():
     else:
         print("Continuing chore cycle, weekno=",str(weekno))
         try:
-            chores=get_from_current_cycle(hist,moncy,names,chores)
+            with phase("history read"):
+                chores=get_from_current_cycle(hist,moncy,names,chores,
+                        history_path)
             do_full_improvement=False
 
         # If can't get beginning of chore cycle, fall back to
         # the new-chore-cycle scheme
         except:
             print("Chore cycle doesn't seem to exist, making new one.")
-            chores=deque(chores)
-            chores.rotate(fourweekno % len(chores))
-            chores=list(chores)
+            with phase("rotation"):
+                chores=deque(chores)
+                chores.rotate(fourweekno % len(chores))
+                chores=list(chores)
             do_full_improvement=True
 
         # Print the baseline as from the beginning of the cycle
@@ -793,16 +2762,17 @@ def main():
         # bump each to the next person.  People who are affected by
         # this bumping go in the "sad" list
         sad=[]
-        for chore in ['Wild','Lawn','Dishes']:
-            for i in [i for (i,c) in enumerate(chores) if c==chore]:
-                print('Rotating',chore,'by',((weekno)%(len(chores)-1)+1))
-                i2=(i+((weekno)%(len(chores)-1)+1))%len(chores)
-                chores[i]=chores[i2]
-                chores[i2]=chore
-                if names[i] not in sad:
-                    sad+=[names[i]]
-                if names[i2] not in sad:
-                    sad+=[names[i2]]
+        with phase("rotation"):
+            for chore in weekly_chores:
+                for i in [i for (i,c) in enumerate(chores) if c==chore]:
+                    print('Rotating',chore,'by',((weekno)%(len(chores)-1)+1))
+                    i2=(i+((weekno)%(len(chores)-1)+1))%len(chores)
+                    chores[i]=chores[i2]
+                    chores[i2]=chore
+                    if names[i] not in sad:
+                        sad+=[names[i]]
+                    if names[i2] not in sad:
+                        sad+=[names[i2]]
         if len(sad): print("Disturbed people:",",".join(sad))
 
     # After all those rotations/bumps, print the "initial condition"
@@ -811,28 +2781,322 @@ def main():
     print_chores(names,chores)
     oldchores=chores[:]
 
-    # Do optimization to the extent requested
-    if do_full_improvement:
-        print("Attempting a full improvement")
-        chores=improve(names,chores,prefs)
+    # Do optimization to the extent requested, noting if it didn't finish
+    outcome={"converged":True}
+    with phase("optimization"):
+        if do_full_improvement:
+            print("Attempting a full improvement")
+            if optimizer=="global":
+                chores=improve_globally(names,chores,prefs,compare,
+                        engine=engine,budget=budget)
+            else:
+                chores=improve(names,chores,prefs,engine=engine,
+                        budget=budget,cache=cache,outcome=outcome)
+        else:
+            print("Attempting a single-switch improvement")
+            chores=improve(names,chores,prefs,restricted_askers=sad,
+                   largeloop=False,engine=engine,budget=budget,cache=cache,
+                   outcome=outcome)
+    if not outcome["converged"]:
+        print("Ran out of time, so there may be more trades to find")
+
+    # Remember it, unless it's unfinished
+    if cache is not None and outcome["converged"]:
+        _cache_put(cache,key,[chores,oldchores])
+
+    # Success, return
+    return chores, oldchores
+
+def plan_cycle(prefs,all_names,all_chores,start,absences={},skips={},
+        plans="cycle_plans",knowns=None,**policy):
+    """Plans all four weeks of a chore cycle in one go.
+
+    The first week is rotated and fully improved as usual, and becomes the
+    baseline that the other three weeks are planned from, with the same
+    weekly bumps and pairwise swaps plan_week would do each week, but with
+    the history kept in memory.  The plan is saved so that when each week
+    comes, plan_week just looks it up (see planned_week) instead of solving
+    it again.  As in simulate, each week only the chores still never done
+    by then have zero misery.
+
+    Args:
+        prefs, all_names, all_chores: as returned by get_preferences
+        start: a date object in the cycle to plan
+        absences: a dict mapping the week of the cycle (0 to 3) to a list of
+            the names expected to be out of town that week
+        skips: a dict mapping the week of the cycle to a list of the chores
+            to skip, by default those at the end of all_chores as in simulate
+        plans: the folder to save the plan in, or None to not save it
+        knowns: who has never done what before the cycle, see simulate
+        **policy: see simulate
+
+    Returns:
+        a list of the four weeks, each a dict of the "monday" (as a string),
+            the "names", "chores" and "oldchores" as from plan_week, and the
+            "prefs" that week will have, see _fingerprint
+    """
+    prefs=as_preferences(prefs)
+    knowns={n:list(c) for n,c in
+            (knowns if knowns is not None else prefs.zeroed()).items()}
+    fourweekno,_,_,moncy=weekinfo(start)
+    hist=[]
+    weeks=[]
+    for k in range(4):
+        _,weekno,mon,_=weekinfo(moncy+datetime.timedelta(7*k))
+
+        # Who is expected around and what needs doing
+        out_of_town=absences.get(k,[])
+        lnames=len(all_names)-len(out_of_town)
+        names,chores,_,_=choose_situation(all_names,all_chores,out_of_town,
+                skips.get(k,all_chores[lnames:] if lnames<len(all_chores)
+                    else []))
+
+        # Plan the week quietly, the first one becoming the baseline
+        week_prefs=prefs.with_knowns(knowns)
+        with contextlib.redirect_stdout(io.StringIO()):
+            chores,oldchores=plan_week(names,chores,week_prefs,weekno,
+                    fourweekno,moncy,hist,compare=False,**policy)
+            note_first_timers(names,chores,knowns)
+        if k==0:
+            hist=[[moncy,dict(zip(names,chores))]]
+        weeks+=[{"monday":str(mon),"names":names,"chores":chores,
+            "oldchores":oldchores,"prefs":_fingerprint(week_prefs)}]
+        print("Planned week of",mon)
+        print_chores(names,chores)
+
+    # Save it
+    if plans is not None:
+        os.makedirs(plans,exist_ok=True)
+        _atomic_write(os.path.join(plans,str(moncy)+".json"),json.dumps(
+            {"policy":_policy_key(**policy),"weeks":weeks},indent=1))
+    return weeks
+
+def planned_week(k,moncy,names,chores,prefs,hist=None,
+        history_path="history.txt",plans="cycle_plans",**policy):
+    """Looks up a week in a cycle plan saved by plan_cycle.
+
+    The plan is only used if it was made with the same policy, this week has
+    the same people, chores and preferences as was planned, and (after the
+    first week) the cycle start in the history is the one that was planned.
+    The planned preferences already allow for anyone doing a chore for the
+    first time in the weeks before (see plan_cycle), but an unexpected
+    absence, a changed spreadsheet, or a first time that wasn't planned
+    (eg a specific assignment) means the week is solved afresh.
+
+    Args:
+        k: the week of the cycle, 0 to 3
+        moncy: as returned by weekinfo
+        names, chores, prefs, hist, history_path: see plan_week
+        plans: the folder the plans were saved in
+        **policy: see simulate
+
+    Returns:
+        chores, oldchores: as from plan_week, or None if there's no plan
+            that fits
+    """
+    try:
+        with open(os.path.join(plans,str(moncy)+".json")) as f:
+            plan=json.load(f)
+    except (OSError,ValueError):
+        return None
+    if plan["policy"]!=_policy_key(**policy):
+        return None
+
+    # Is this week as planned?
+    week=plan["weeks"][k]
+    if week.get("prefs")!=_fingerprint(prefs) \
+            or sorted(week["names"])!=sorted(names) \
+            or sorted(week["chores"])!=sorted(chores):
+        return None
+
+    # And did the cycle start go as planned?
+    if k:
+        first=plan["weeks"][0]
+        if hist is None:
+            cycle_start=read_week(moncy,history_path)
+        else:
+            cycle_start=next((h[1] for h in reversed(hist) if h[0]==moncy),
+                    None)
+        if cycle_start!=dict(zip(first["names"],first["chores"])):
+            return None
+
+    # Put it in this week's order
+    planned=dict(zip(week["names"],week["chores"]))
+    old=dict(zip(week["names"],week["oldchores"]))
+    return [planned[n] for n in names],[old[n] for n in names]
+
+def _fingerprint(prefs):
+    """Returns a hash of the preferences, to tell when they've changed."""
+    prefs=as_preferences(prefs)
+    digest=hashlib.sha256(json.dumps([prefs.names,prefs.chores]).encode())
+    digest.update(np.ascontiguousarray(prefs.mat).tobytes())
+    return digest.hexdigest()
+
+def _policy_key(optimizer="loops",engine="dfs",
+        weekly_chores=('Wild','Lawn','Dishes'),**rest):
+    """Returns the parts of a policy (see simulate) that shape the plan."""
+    return {"optimizer":optimizer,"engine":engine,
+            "weekly_chores":list(weekly_chores)}
+
+def replan(mon,prefs,remove=(),add=(),skip=(),unskip=(),
+        history_path="history.txt",engine="dfs"):
+    """Re-plans a saved week after a last-minute change.
+
+    Starts from the assignment saved in the history, so nothing is rotated
+    or solved again.  Only the people left without a chore (newcomers, and
+    anyone whose chore was skipped) are given one, the least miserable way
+    of handing out the chores that were freed up, and then just those people
+    get to seek pairwise swaps.  Everyone else keeps their chore unless
+    someone who was touched would rather swap with them.  Specific
+    assignments aren't recorded in the history, so they may be swapped too.
+
+    Args:
+        mon: the Monday date object of the week
+        prefs: as returned by get_preferences
+        remove: names of people who have dropped out
+        add: names of people who have turned up
+        skip: chores no longer to be done
+        unskip: chores to be done after all
+        history_path: the history file the week was saved in
+        engine: see improve
+
+    Returns:
+        names, chores: the new assignment
+        oldchores: the chores before the swaps, ie after freed-up chores were
+            handed out
+    """
+    prefs=as_preferences(prefs)
+    saved=read_week(mon,history_path)
+    assert saved is not None, "No assignment saved for "+str(mon)
+    for name in remove:
+        assert name in saved, "Who is "+name+"!?"
+    for name in add:
+        assert name in prefs.name_index, "Who is "+name+"!?"
+        assert name not in saved, name+" already has a chore"
+    for chore in skip:
+        assert chore in saved.values() and chore!='Wild', \
+                "Nobody has "+chore+" to skip"
+    for chore in unskip:
+        assert chore in prefs.chore_index and chore!='Wild', \
+                "What is "+chore+"!?"
+        assert chore not in saved.values(), chore+" isn't skipped"
+
+    # Who keeps their chore, who needs one, and which chores are up for grabs
+    staying=[name for name in saved if name not in remove]
+    kept={name:saved[name] for name in staying if saved[name] not in skip}
+    free=[name for name in staying if name not in kept]+list(add)
+    pool=[saved[name] for name in remove
+            if saved[name]!='Wild' and saved[name] not in skip]+list(unskip)
+
+    # Add or take away Wild fillers to match the number of people.  People
+    # with Wild can keep it if there's still enough to go round
+    wild=[name for name in kept if kept[name]=='Wild']
+    nchores=len(kept)-len(wild)+len(pool)
+    nnames=len(staying)+len(add)
+    assert nchores<=nnames,\
+            "Must skip exactly "+str(nchores-nnames)+" more chores."
+    nwild=nnames-nchores
+    if len(wild)>nwild:
+        for name in wild:
+            del kept[name]
+        free+=wild
+        pool+=['Wild']*nwild
     else:
-        print("Attempting a single-switch improvement")
-        chores=improve(names,chores,prefs,restricted_askers=sad,
-               largeloop=False)
+        pool+=['Wild']*(nwild-len(wild))
+
+    # Hand out the free chores the least miserable way
+    names=staying+list(add)
+    assignment=dict(kept)
+    if len(free):
+        cost=prefs.mat[np.ix_(prefs.rows(free),prefs.cols(pool))]
+        for name,j in zip(free,_linear_assignment(cost)):
+            assignment[name]=pool[j]
+    oldchores=[assignment[name] for name in names]
+
+    # Then let just those people look for swaps
+    chores=oldchores
+    if len(free):
+        chores=improve(names,oldchores,prefs,restricted_askers=free,
+                largeloop=False,engine=engine)
+    return names,chores,oldchores
+
+def note_first_timers(names,chores,knowns):
+    """Takes each person's chore off their never-done list in knowns."""
+    for name,chore in zip(names,chores):
+        if chore in knowns[name]:
+
+            # Alert about first-timers
+            print(name+" is doing "+chore+" for the first time.")
+            knowns[name].remove(chore)
+
+def save_week(hist,mon,weekno,names,chores,oldchores,prefs,knowns,
+        history_path="history.txt",knownpeople_path="knownpeople.txt",
+        chart_path="Misery.png",email_path="email.html",preview=True,
+        url=None):
+    """Adds to history, known list, makes a chart, and makes the email.
+
+    Args:
+        hist, mon: see add_to_history
+        weekno: as returned by weekinfo
+        names, chores: the final chore assignment
+        oldchores, prefs: see show_improvement
+        knowns: see write_knownpeople
+        history_path, knownpeople_path, chart_path, email_path: where to
+            put each of those
+        preview, url: see make_email
+    """
+    # Draw the chart in the background while everything else is saved
+    chart=render_later(show_improvement,names,chores,oldchores,prefs,
+            chart_path)
+    with phase("save"):
+        add_to_history(hist,mon,names,chores,history_path)
+        write_knownpeople(knowns,knownpeople_path)
+    with phase("email"):
+        make_email(names,chores,weekno,mon,email_path,preview,url)
+    chart.result()
+
+def main(optimizer="loops",knowns_from_history=False,ttl=0,engine="dfs",
+        budget=None,cache="result_cache"):
+    """Runs everything as described at the top.
+
+    Args:
+        optimizer: how to do the full improvement at the start of a cycle,
+            "loops" for improve() or "global" for improve_globally()
+        knowns_from_history: see get_preferences
+        ttl: see fetch_tsv
+        engine, budget: see improve
+        cache: see plan_week, or None to work everything out afresh
+    """
+
+    # Get the preferences from the Misery spreadsheet
+    all_names, all_chores, prefs, knowns =get_preferences(knowns_from_history,
+            ttl=ttl)
+
+    # Narrow down to what people and chores we want this week
+    names, chores, force_names, force_chores=\
+            get_current_situation(all_names,all_chores)
+    del all_names, all_chores
+    print("\n\n")
+
+    # Get the info for this week.  The history is only read a week at a
+    # time as needed, see read_week
+    fourweekno,weekno,mon,moncy=weekinfo()
+    hist=None
+
+    # Rotate, bump and improve
+    chores,oldchores=plan_week(names,chores,prefs,weekno,fourweekno,moncy,
+            hist,optimizer,engine=engine,budget=budget,plans="cycle_plans",
+            cache=cache)
 
     # Print the final assignments, adding in forced assignments
     print("\n\nHere's the final condition")
     names+=force_names
     chores+=force_chores
+    oldchores+=force_chores
     print_chores(names,chores)
 
     # Update the knowns list
-    for name,chore in zip(names,chores):
-        if chore in knowns[name]:
-
-            # Alert about first-timers
-            print(name+" is doing "+chore+" for the first time.")
-            knowns[name].remove(chore)
+    note_first_timers(names,chores,knowns)
 
     # Confirm before altering any external files
     while True:
@@ -840,15 +3104,423 @@ def main():
 
         # Add to history, known list, make a chart, and make the email
         if act.lower()=='s':
-            add_to_history(hist,mon,names,chores)
-            write_knownpeople(knowns)
-            show_improvement(names,chores,oldchores,prefs)
-            make_email(names,chores,weekno,mon)
+            save_week(hist,mon,weekno,names,chores,oldchores,prefs,knowns)
             exit()
 
         # Or just quit
         elif act.lower()=='c':
             exit()
+
+def main_plan(absences_path=None,optimizer="loops",knowns_from_history=False,
+        ttl=0,engine="dfs"):
+    """Plans a whole cycle ahead, so the weekly runs just look it up.
+
+    Plans this cycle if this is its first week, or otherwise the next one,
+    see plan_cycle.
+
+    Args:
+        absences_path: a JSON file of the absences expected, mapping the week
+            of the cycle (0 to 3) to a list of names, eg {"2":["SB"]}
+        optimizer, knowns_from_history, ttl, engine: see main
+    """
+    all_names,all_chores,prefs,knowns=get_preferences(knowns_from_history,
+            ttl=ttl)
+    absences={}
+    if absences_path:
+        with open(absences_path) as f:
+            absences={int(k):v for k,v in json.load(f).items()}
+    fourweekno,weekno,mon,moncy=weekinfo()
+    if weekno%4:
+        moncy+=datetime.timedelta(7*4)
+    plan_cycle(prefs,all_names,all_chores,moncy,absences,knowns=knowns,
+            optimizer=optimizer,engine=engine)
+
+def main_replan(remove=(),add=(),skip=(),unskip=(),knowns_from_history=False,
+        ttl=float("inf"),engine="dfs"):
+    """Re-plans this week after a last-minute change, see replan.
+
+    Args:
+        remove, add, skip, unskip: see replan
+        knowns_from_history, engine: see main
+        ttl: see fetch_tsv.  By default the preferences fetched for this
+            week's run are reused, since they're what the week was planned
+            with, and they're only fetched again if there's no copy
+    """
+    all_names,all_chores,prefs,knowns=get_preferences(knowns_from_history,
+            ttl=ttl)
+    fourweekno,weekno,mon,moncy=weekinfo()
+    names,chores,oldchores=replan(mon,prefs,remove,add,skip,unskip,
+            engine=engine)
+    print("\n\nHere's the new condition")
+    print_chores(names,chores)
+    note_first_timers(names,chores,knowns)
+
+    # Confirm before altering any external files
+    while True:
+        act=input("\nSave these results into history, or cancel? [S or C]: ")
+        if act.lower()=='s':
+            save_week(None,mon,weekno,names,chores,oldchores,prefs,knowns)
+            exit()
+        elif act.lower()=='c':
+            exit()
+
+def run_house(house):
+    """Runs one house's weekly assignment without asking anything.
+
+    Everything printed goes to the house's log file instead of the screen.
+
+    Args:
+        house: one house from the manifest, as filled out by run_batch
+
+    Returns:
+        a dict summarizing how it went, with "house", "ok", "seconds",
+        "misery_before", "misery_after", "assignment" and "error"
+    """
+    summary={"house":house["name"],"ok":False,"error":None}
+    start=time.time()
+    os.makedirs(house["dir"],exist_ok=True)
+    with open(house["log"],'w') as log, contextlib.redirect_stdout(log):
+        try:
+            # Same as main, but with the answers given in the manifest
+            all_names,all_chores,prefs,knowns=get_preferences(
+                    house["knowns_from_history"],house["source"],
+                    house["knownpeople"],house["history"],
+                    os.path.join(house["dir"],"preference_cache"))
+            names,chores,force_names,force_chores=choose_situation(
+                    all_names,all_chores,house["out_of_town"],
+                    house["skip"],house["force"])
+            fourweekno,weekno,mon,moncy=weekinfo()
+            chores,oldchores=plan_week(names,chores,prefs,weekno,
+                    fourweekno,moncy,None,house["optimizer"],house["history"])
+            print("\n\nHere's the final condition")
+            names+=force_names
+            chores+=force_chores
+            oldchores+=force_chores
+            print_chores(names,chores)
+            note_first_timers(names,chores,knowns)
+
+            # Save everything without opening a browser
+            save_week(None,mon,weekno,names,chores,oldchores,prefs,knowns,
+                    house["history"],house["knownpeople"],house["chart"],
+                    house["email"],False,house["sheet_url"])
+            summary.update(ok=True,
+                    misery_before=misery(names,oldchores,prefs),
+                    misery_after=misery(names,chores,prefs),
+                    assignment=dict(zip(names,chores)))
+
+        # Record what went wrong, but don't take the batch down with us
+        except Exception as e:
+            traceback.print_exc(file=log)
+            summary["error"]=repr(e)
+
+    summary["seconds"]=time.time()-start
+    return summary
+
+def run_batch(manifest_path,workers=None,summary_path=None):
+    """Runs the weekly assignment for many houses in parallel.
+
+    The manifest is a JSON file with a list of "houses", each of which has a
+    "name" and can have:
+        "dir": the folder for the house's files (default: its name, relative
+            to the manifest)
+        "source": the URL or file of its preference TSV (default: tsv_url)
+        "sheet_url": the spreadsheet link for the email (default: source,
+            or no link if source is a local file)
+        "history", "knownpeople": its history and knownpeople files
+        "chart", "email", "log": where to put its outputs
+            (all of these are relative to the house's dir)
+        "out_of_town", "skip", "force": answers to the questions
+            get_current_situation would ask, see choose_situation
+        "optimizer", "knowns_from_history": see main
+
+    Each house runs in a worker process (see run_house), and one house
+    failing doesn't stop the others.
+
+    Args:
+        manifest_path: the manifest file
+        workers: how many worker processes, default one per core
+        summary_path: where to write the JSON summary of all the houses,
+            default batch_summary.json next to the manifest
+
+    Returns:
+        summaries: a list of what run_house returned for each house
+    """
+    with open(manifest_path,'r') as f:
+        manifest=json.load(f)
+    root=os.path.dirname(os.path.abspath(manifest_path))
+
+    # Fill out each house with its defaults
+    houses=[]
+    for h in manifest["houses"]:
+        d=os.path.join(root,h.get("dir",h["name"]))
+        source=h.get("source",tsv_url)
+        houses+=[{
+            "name":h["name"],
+            "dir":d,
+            "source":source if "://" in source else os.path.join(root,source),
+            "sheet_url":h.get("sheet_url",source if "://" in source else ""),
+            "history":os.path.join(d,h.get("history","history.txt")),
+            "knownpeople":os.path.join(d,
+                h.get("knownpeople","knownpeople.txt")),
+            "chart":os.path.join(d,h.get("chart","Misery.png")),
+            "email":os.path.join(d,h.get("email","email.html")),
+            "log":os.path.join(d,h.get("log","log.txt")),
+            "out_of_town":h.get("out_of_town",[]),
+            "skip":h.get("skip",[]),
+            "force":h.get("force",{}),
+            "optimizer":h.get("optimizer","loops"),
+            "knowns_from_history":h.get("knowns_from_history",False)}]
+
+    # Run them all
+    print("Running",len(houses),"houses",flush=True)
+    summaries=[None]*len(houses)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures={pool.submit(run_house,h):i for i,h in enumerate(houses)}
+        for future in concurrent.futures.as_completed(futures):
+            i=futures[future]
+            try:
+                summaries[i]=future.result()
+            except Exception as e:
+                summaries[i]={"house":houses[i]["name"],"ok":False,
+                        "error":repr(e)}
+            print("{:15s} {}".format(houses[i]["name"],
+                "done" if summaries[i]["ok"] else
+                "FAILED: "+summaries[i]["error"]),flush=True)
+
+    # Write out the summary
+    summary_path=summary_path if summary_path else\
+            os.path.join(root,"batch_summary.json")
+    _atomic_write(summary_path,json.dumps(summaries,indent=1))
+    return summaries
+
+def simulate(prefs,all_names,all_chores,start,nweeks,absences={},hist=None,
+        knowns=None,**policy):
+    """Simulates weeks of chore assignments without asking or saving anything.
+
+    Each week goes through plan_week just as main() would, with the history
+    kept in memory.  When there are more chores than people in town, the
+    chores at the end of all_chores are the ones skipped.  As in main(),
+    each week only the chores still never done have zero misery, and anyone
+    doing one for the first time has it taken off (see note_first_timers).
+
+    Args:
+        prefs: as returned by get_preferences, eg from a saved TSV
+        all_names, all_chores: as returned by get_preferences
+        start: a date object in the first week to simulate
+        nweeks: how many weeks to simulate
+        absences: a dict mapping the number of a week (counting from zero at
+            start) to a list of the names out of town that week
+        hist: as returned by read_history, the history before start, which
+            is not changed
+        knowns: as returned by get_preferences, who had never done what
+            before start, which is not changed.  By default, the chores
+            prefs has zeroed, see Preferences.zeroed
+        **policy: passed on to plan_week, ie optimizer, engine and
+            weekly_chores
+
+    Returns:
+        a dict of lists with one entry per week: "mondays" (as strings),
+        "misery_before" and "misery_after" (before and after improvement, as
+        the house saw it that week) and "assignments" (dicts mapping names to
+        chores)
+    """
+    prefs=as_preferences(prefs)
+    knowns={n:list(c) for n,c in
+            (knowns if knowns is not None else prefs.zeroed()).items()}
+    hist=list(hist) if hist else []
+    trajectory={"mondays":[],"misery_before":[],"misery_after":[],
+            "assignments":[]}
+    for k in range(nweeks):
+        fourweekno,weekno,mon,moncy=weekinfo(start+datetime.timedelta(7*k))
+
+        # Who is around and what needs doing
+        out_of_town=absences.get(k,[])
+        lnames=len(all_names)-len(out_of_town)
+        names,chores,_,_=choose_situation(all_names,all_chores,out_of_town,
+                all_chores[lnames:] if lnames<len(all_chores) else [])
+
+        # Plan the week quietly, and remember it
+        week_prefs=prefs.with_knowns(knowns)
+        with contextlib.redirect_stdout(io.StringIO()):
+            chores,oldchores=plan_week(names,chores,week_prefs,weekno,
+                    fourweekno,moncy,hist,compare=False,**policy)
+            note_first_timers(names,chores,knowns)
+        hist+=[[mon,dict(zip(names,chores))]]
+
+        trajectory["mondays"]+=[str(mon)]
+        trajectory["misery_before"]+=[misery(names,oldchores,week_prefs)]
+        trajectory["misery_after"]+=[misery(names,chores,week_prefs)]
+        trajectory["assignments"]+=[dict(zip(names,chores))]
+    return trajectory
+
+def replay_history(prefs,hist,knowns=None,**policy):
+    """Replays recorded weeks to see how a different policy would have done.
+
+    For each week in hist, the people and chores recorded that week are
+    planned again with plan_week, using the replayed weeks before it as the
+    history.  Anyone or any chore not in prefs is left out.  Never-done
+    chores are kept track of through the replayed weeks as in simulate.
+
+    Args:
+        prefs: as returned by get_preferences
+        hist: as returned by read_history
+        knowns: who had never done what before the first week of hist, see
+            simulate
+        **policy: see simulate
+
+    Returns:
+        a dict of lists like simulate, plus "misery_recorded", the misery of
+        what was actually recorded each week
+    """
+    prefs=as_preferences(prefs)
+    knowns={n:list(c) for n,c in
+            (knowns if knowns is not None else prefs.zeroed()).items()}
+    replayed=[]
+    trajectory={"mondays":[],"misery_recorded":[],"misery_before":[],
+            "misery_after":[],"assignments":[]}
+    for mon,assig in hist:
+        fourweekno,weekno,_,moncy=weekinfo(mon)
+
+        # The people and chores of this week that prefs knows about
+        pairs=[(n,c) for n,c in assig.items()
+                if n in prefs.name_index and c in prefs.chore_index]
+        if not len(pairs):
+            continue
+        names,recorded=[list(x) for x in zip(*pairs)]
+
+        # Plan the week again quietly, from its chores in sheet order
+        chores=sorted(recorded,key=lambda c:prefs.chore_index[c])
+        week_prefs=prefs.with_knowns(knowns)
+        with contextlib.redirect_stdout(io.StringIO()):
+            chores,oldchores=plan_week(names,chores,week_prefs,weekno,
+                    fourweekno,moncy,replayed,compare=False,**policy)
+            note_first_timers(names,chores,knowns)
+        replayed+=[[mon,dict(zip(names,chores))]]
+
+        trajectory["mondays"]+=[str(mon)]
+        trajectory["misery_recorded"]+=[misery(names,recorded,week_prefs)]
+        trajectory["misery_before"]+=[misery(names,oldchores,week_prefs)]
+        trajectory["misery_after"]+=[misery(names,chores,week_prefs)]
+        trajectory["assignments"]+=[dict(zip(names,chores))]
+    return trajectory
+
+def run_scenarios(scenarios,workers=None):
+    """Runs simulate or replay_history for many scenarios in parallel.
+
+    Args:
+        scenarios: a dict mapping the name of each scenario to a dict of the
+            arguments for simulate, or for replay_history if it has "hist"
+            but not "start"
+        workers: how many worker processes, default one per core
+
+    Returns:
+        a dict mapping the name of each scenario to its trajectory
+    """
+    trajectories={}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures={}
+        for name,kwargs in scenarios.items():
+            run=replay_history if "start" not in kwargs else simulate
+            futures[pool.submit(run,**kwargs)]=name
+        for future in concurrent.futures.as_completed(futures):
+            name=futures[future]
+            trajectories[name]=future.result()
+            print("{:20s} mean misery {:.3f}".format(name,
+                np.mean(trajectories[name]["misery_after"])),flush=True)
+    return {name:trajectories[name] for name in scenarios}
+
+def check_startup(budget=0.5):
+    """Checks that importing this module stays quick.
+
+    Imports it in a fresh interpreter and times it, and makes sure the slow
+    imports (matplotlib, requests and asyncio) were put off.
+
+    Args:
+        budget: the most seconds the import may take
+
+    Returns:
+        the seconds the import took
+    """
+    out=subprocess.run([sys.executable,"-c",
+        "import time,sys\n"
+        "t=time.perf_counter()\n"
+        "import chores\n"
+        "print(time.perf_counter()-t)\n"
+        "print(' '.join(m for m in ('matplotlib','requests','asyncio')"
+        " if m in sys.modules))"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,text=True,check=True).stdout.splitlines()
+    seconds=float(out[0])
+    assert len(out)<2 or not out[1], "Imported at startup: "+out[1]
+    assert seconds<=budget,\
+            "Import took {:.3f}s, over the {}s budget".format(seconds,budget)
+    print("Import took {:.3f}s".format(seconds))
+    return seconds
+
 # Go
 if __name__=="__main__":
-    main()
+    parser=argparse.ArgumentParser(description="Assigns this week's chores.")
+    parser.add_argument("--global",dest="optimizer",action="store_const",
+            const="global",default="loops",
+            help="at the start of a cycle, find the least miserable "
+            "assignment that leaves no one worse off, instead of swapping loops")
+    parser.add_argument("--engine",choices=sorted(engines),default="dfs",
+            help="how to search for loops, see improve")
+    parser.add_argument("--budget",type=float,metavar="SECONDS",
+            help="stop looking for trades after this long")
+    parser.add_argument("--no-cache",action="store_true",
+            help="work the week out afresh instead of reusing a saved result")
+    parser.add_argument("--knowns-from-history",action="store_true",
+            help="work out who has never done each chore from history.txt "
+            "instead of knownpeople.txt")
+    parser.add_argument("--plan-cycle",nargs="?",const="",metavar="ABSENCES",
+            help="plan a whole cycle ahead, given a JSON file of who is "
+            "expected away each week, see main_plan")
+    parser.add_argument("--replan",action="store_true",
+            help="re-plan this week's saved chores after a last-minute "
+            "change given by --remove, --add, --skip and --unskip")
+    for flag,what in [("--remove","people who have dropped out"),
+            ("--add","people who have turned up"),
+            ("--skip","chores no longer to be done"),
+            ("--unskip","chores to be done after all")]:
+        parser.add_argument(flag,nargs="+",default=[],help="with --replan, "+what)
+    parser.add_argument("--refetch",action="store_true",
+            help="with --replan, fetch the preferences again instead of "
+            "reusing the last copy")
+    parser.add_argument("--batch",metavar="MANIFEST",
+            help="run every house in a manifest instead, see run_batch")
+    parser.add_argument("--workers",type=int,
+            help="how many houses to run at once with --batch")
+    parser.add_argument("--ttl",type=float,default=0,
+            help="seconds to reuse the last copy of the preferences without "
+            "checking the sheet for changes")
+    parser.add_argument("--check-startup",action="store_true",
+            help="check that importing this script is still quick")
+    parser.add_argument("--trace",metavar="PATH",
+            help="save a JSON trace of where the run spent its time, "
+            "see start_trace")
+    args=parser.parse_args()
+    if args.trace:
+        start_trace()
+    try:
+        if args.check_startup:
+            check_startup()
+        elif args.batch:
+            run_batch(args.batch,args.workers)
+        elif args.replan:
+            main_replan(args.remove,args.add,args.skip,args.unskip,
+                    knowns_from_history=args.knowns_from_history,
+                    ttl=args.ttl if args.refetch else float("inf"),
+                    engine=args.engine)
+        elif args.plan_cycle is not None:
+            main_plan(args.plan_cycle,optimizer=args.optimizer,
+                    knowns_from_history=args.knowns_from_history,ttl=args.ttl,
+                    engine=args.engine)
+        else:
+            main(optimizer=args.optimizer,
+                    knowns_from_history=args.knowns_from_history,ttl=args.ttl,
+                    engine=args.engine,budget=args.budget,
+                    cache=None if args.no_cache else "result_cache")
+    finally:
+        if args.trace:
+            stop_trace(args.trace)
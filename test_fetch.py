@@ -0,0 +1,144 @@
+##########
+# File:     test_fetch.py
+#
+# Tests fetching the preference sheet, against a stand-in server on
+# localhost, so they run offline.  Run with "python -m pytest".
+#
+##########
+
+
+# Imports
+import datetime
+import hashlib
+import http.server
+import os
+import threading
+import time
+import pytest
+import chores
+
+
+# A small preference sheet for the stand-in server to serve
+sheet=b"\tA\tB\nDishes\t1\t2\nLawn\t2\t1\n"
+
+class SheetHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the sheet with an ETag, answering 304 if it hasn't changed.
+
+    Paths starting /missing are not found, and paths starting /slow take a
+    while, noting the most requests that were being answered at once.
+    """
+
+    def do_GET(self):
+        self.server.requests+=[(self.path,self.headers.get("If-None-Match"))]
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+            return
+        if self.path.startswith("/slow"):
+            with self.server.lock:
+                self.server.active+=1
+                self.server.most_active=max(self.server.most_active,
+                        self.server.active)
+            time.sleep(0.2)
+            with self.server.lock:
+                self.server.active-=1
+        if self.headers.get("If-None-Match")=='"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag",'"v1"')
+        self.send_header("Content-Length",str(len(sheet)))
+        self.end_headers()
+        self.wfile.write(sheet)
+
+    def log_message(self,*args):
+        pass
+
+@pytest.fixture
+def server():
+    """Runs the stand-in server in the background for one test."""
+    httpd=http.server.ThreadingHTTPServer(("127.0.0.1",0),SheetHandler)
+    httpd.requests=[]
+    httpd.lock=threading.Lock()
+    httpd.active,httpd.most_active=0,0
+    thread=threading.Thread(target=httpd.serve_forever,daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def url_of(httpd,path="/sheet.tsv"):
+    """Returns the URL of a path on the stand-in server."""
+    return "http://127.0.0.1:{}{}".format(httpd.server_address[1],path)
+
+def test_etag_round_trip(server,tmp_path,capsys):
+    url=url_of(server)
+    assert chores.fetch_tsv(url,cache_dir=str(tmp_path))==sheet
+    assert chores.fetch_tsv(url,cache_dir=str(tmp_path))==sheet
+
+    # The second time, the server was asked if the copy was still good
+    assert [etag for path,etag in server.requests]==[None,'"v1"']
+    assert "haven't changed" in capsys.readouterr().out
+
+def test_ttl_skips_the_request(server,tmp_path):
+    url=url_of(server)
+    chores.fetch_tsv(url,cache_dir=str(tmp_path))
+    assert chores.fetch_tsv(url,cache_dir=str(tmp_path),ttl=3600)==sheet
+    assert len(server.requests)==1
+
+def test_offline_uses_last_copy(server,tmp_path):
+    url=url_of(server)
+    chores.fetch_tsv(url,cache_dir=str(tmp_path))
+    server.shutdown()
+    server.server_close()
+    assert chores.fetch_tsv(url,cache_dir=str(tmp_path),timeout=1)==sheet
+
+def test_offline_without_a_copy_fails(server,tmp_path):
+    url=url_of(server)
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(Exception):
+        chores.fetch_tsv(url,cache_dir=str(tmp_path),timeout=1)
+
+def test_dated_snapshot(server,tmp_path):
+    url=url_of(server)
+    chores.fetch_tsv(url,cache_dir=str(tmp_path))
+    snapshot=os.path.join(str(tmp_path),
+            hashlib.sha256(url.encode()).hexdigest()[:16]
+            +"_"+str(datetime.date.today())+".tsv")
+    with open(snapshot,'rb') as f:
+        assert f.read()==sheet
+
+    # And the snapshot can be replayed as the preferences
+    with open(snapshot,'rb') as f:
+        all_names,all_chores,prefs=chores.parse_preferences(f)
+    assert all_names==["A","B"] and prefs["B"]["Lawn"]==1
+
+def test_fetch_all_bounds_concurrency(server,tmp_path):
+    urls=[url_of(server,"/slow/{}".format(i)) for i in range(6)]
+    results=chores.fetch_all(urls,concurrency=2,cache_dir=str(tmp_path))
+    assert server.most_active==2
+    assert len(server.requests)==6
+    assert all(results[url][0]==["A","B"] for url in urls)
+
+def test_fetch_all_keeps_every_connection(server,tmp_path,caplog):
+    urls=[url_of(server,"/slow/{}".format(i)) for i in range(24)]
+    chores.fetch_all(urls,concurrency=24,cache_dir=str(tmp_path))
+    assert server.most_active>16
+    assert "pool is full" not in caplog.text
+
+def test_fetch_all_keys_by_source(server,tmp_path):
+    local=os.path.join(str(tmp_path),"local.tsv")
+    with open(local,'wb') as f:
+        f.write(sheet.replace(b"\tB",b"\tC"))
+    urls=[url_of(server,"/a"),url_of(server,"/b"),local]
+    results=chores.fetch_all(urls+[urls[0]],cache_dir=str(tmp_path))
+    assert list(results)==urls
+    assert results[urls[0]][0]==results[urls[1]][0]==["A","B"]
+    assert results[local][0]==["A","C"]
+
+def test_fetch_all_keeps_failures_apart(server,tmp_path):
+    good,bad=url_of(server,"/good"),url_of(server,"/missing")
+    results=chores.fetch_all([good,bad],cache_dir=str(tmp_path))
+    assert results[good][0]==["A","B"]
+    assert isinstance(results[bad],AssertionError)
@@ -0,0 +1,47 @@
+##########
+# File:     test_history.py
+#
+# Tests reading and saving the history file and its index, see
+# add_to_history.  Run with "python -m pytest".
+#
+##########
+
+
+# Imports
+import datetime
+import chores
+
+
+names=['A','B']
+jan=[datetime.date(2024,1,d) for d in (1,8,15,22)]
+
+def test_legacy_history_keeps_its_last_row(tmp_path):
+
+    # An older history file whose last row has no newline
+    path=str(tmp_path/"history.txt")
+    with open(path,'w') as f:
+        f.write("2024-01-01,A:Dishes,B:Lawn\n2024-01-08,A:Lawn,B:Dishes")
+    assert [mon for mon,_ in chores.read_history(path)]==jan[:2]
+
+    # Saving finishes that row off rather than dropping it
+    chores.add_to_history(None,jan[2],names,['Dishes','Lawn'],path)
+    assert [mon for mon,_ in chores.read_history(path)]==jan[:3]
+    assert chores.read_week(jan[1],path)=={'A':'Lawn','B':'Dishes'}
+
+def test_interrupted_save_is_dropped(tmp_path):
+    path=str(tmp_path/"history.txt")
+    chores.add_to_history(None,jan[0],names,['Dishes','Lawn'],path)
+
+    # A save cut off part-way, after noting it had started
+    index,end,built=chores._history_index(path)
+    chores._restamp_history_index(path,built,saving_from=end)
+    with open(path,'a') as f:
+        f.write("2024-01-08,A:Lawn,B:La")
+    assert [mon for mon,_ in chores.read_history(path)]==jan[:1]
+    assert jan[1] not in chores.read_history_index(path)
+
+    # The next save replaces the partial row
+    chores.add_to_history(None,jan[1],names,['Lawn','Dishes'],path)
+    assert chores.read_history(path)[-1]==[jan[1],{'A':'Lawn','B':'Dishes'}]
+    with open(path) as f:
+        assert "B:La\n" not in f.read()
@@ -0,0 +1,100 @@
+##########
+# File:     test_search.py
+#
+# Tests that the faster loop searches give exactly the same answers as
+# _seek_loop, ties included.  Run with "python -m pytest".
+#
+##########
+
+
+# Imports
+import random
+import numpy as np
+import pytest
+import chores
+
+
+def random_misery(seed):
+    """Makes a small misery matrix, with plenty of ties and zeros."""
+    rng=np.random.default_rng(seed)
+    n=int(rng.integers(2,8))
+    return rng.integers(0,4,(n,n)).astype(float)
+
+def same(found,expected):
+    """Checks two searches' answers match, as they return lists or tuples."""
+    return tuple(found)==tuple(expected)
+
+@pytest.mark.parametrize("largeloop",[True,False])
+def test_bnb_matches_recursive(largeloop):
+    for seed in range(500):
+        W=random_misery(seed)
+        for curr in range(len(W)):
+            assert same(chores._seek_loop_bnb(W,curr,largeloop=largeloop),
+                    chores._seek_loop(W,curr,largeloop=largeloop)), seed
+
+def test_bnb_matches_recursive_part_way():
+
+    # Searches continued from part-way along a branch
+    for seed in range(300):
+        W=random_misery(seed)
+        if len(W)<3:
+            continue
+        included=[len(W)-1]
+        improvement=1.0
+        for curr in range(len(W)-1):
+            assert same(chores._seek_loop_bnb(W,curr,included,improvement),
+                    chores._seek_loop(W,curr,included,improvement)), seed
+
+def test_swap_matches_recursive():
+    for seed in range(500):
+        W=random_misery(seed)
+        for curr in range(len(W)):
+            assert same(chores._seek_swap(W,curr),
+                    chores._seek_loop(W,curr,largeloop=False)), seed
+
+def test_parallel_matches_recursive():
+    for seed in range(40):
+        W=random_misery(seed)
+        for curr in range(len(W)):
+            assert same(chores._seek_loop_parallel(W,curr),
+                    chores._seek_loop(W,curr)), seed
+
+def random_house(seed):
+    """Makes a small house with few distinct miseries, so plenty of ties."""
+    rng=random.Random(seed)
+    names=["P{}".format(i) for i in range(rng.randint(4,9))]
+    all_chores=["C{}".format(j) for j in range(rng.randint(4,9))]
+    rows=all_chores+['Wild']
+    prefs=chores.Preferences(names,rows,
+            [[rng.randint(1,3) for c in rows] for n in names])
+    prefs.apply_knowns({n:[c for c in all_chores if rng.random()<0.3]
+        for n in names})
+    week_chores=all_chores[:len(names)]\
+            +['Wild']*max(len(names)-len(all_chores),0)
+    rng.shuffle(week_chores)
+    return names,week_chores,prefs
+
+@pytest.mark.parametrize("largeloop,restricted",[(True,False),(False,True)])
+def test_improve_reuses_searches_exactly(largeloop,restricted,monkeypatch,
+        capsys):
+    houses=[random_house(seed) for seed in range(300)]
+    unchanged=chores._loop_search_unchanged
+
+    # The trades made, reusing earlier searches where they still hold
+    def run():
+        outputs=[]
+        for names,week_chores,prefs in houses:
+            askers=names[::2] if restricted else None
+            new_chores=chores.improve(names,week_chores,prefs,
+                    restricted_askers=askers,largeloop=largeloop)
+            outputs+=[(new_chores,capsys.readouterr().out)]
+        return outputs
+    reused=[]
+    monkeypatch.setattr(chores,"_loop_search_unchanged",
+            lambda *args:reused.append(unchanged(*args)) or reused[-1])
+    with_reuse=run()
+    assert any(reused)
+
+    # Then with every search done afresh
+    monkeypatch.setattr(chores,"_loop_search_unchanged",lambda *args:False)
+    assert run()==with_reuse
@@ -0,0 +1,17 @@
+##########
+# File:     test_startup.py
+#
+# Tests that importing chores.py stays quick, see check_startup.
+# Run with "python -m pytest".
+#
+##########
+
+
+# Imports
+import chores
+
+
+def test_import_is_quick():
+
+    # Fails if the import is over budget or does a slow import up front
+    chores.check_startup()